@@ -0,0 +1,7 @@
+from pathlib import Path
+import sys
+
+# the modules import each other by their plain names, as they are run from this directory, e.g. python -m cache. Adding
+# the directory to the path makes those imports work when they are run from the repository root too, e.g.
+# python -m commit_attribute_miner.cache
+sys.path.insert(0, str(Path(__file__).resolve().parent))
@@ -1,25 +1,102 @@
-from dataclasses import dataclass
+from argparse import ArgumentParser
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cache
+from hashlib import sha256
+from itertools import islice
 from pathlib import Path
-import pickle
+import atexit
+import json
 import logging
+import os
+import socket
 import time
+from typing import Callable, Iterable, Iterator, TypeVar
 
 from github import Github
 from github.Repository import Repository
 from github.Commit import Commit
-from github.GithubException import GithubException, RateLimitExceededException
+from github.File import File
+from github.PaginatedList import PaginatedList
+from github.GithubException import GithubException, RateLimitExceededException, UnknownObjectException
 
 from config import get_config
-from util import get_github_instance
+from transport import get_transport, TRANSIENT_REQUEST_EXCEPTIONS
+from util import get_github_instance, tokenize_patch, TOKENIZER_VERSION
+from storage import atomic_save_pickle, atomic_write_bytes, load_cached_pickle, file_lock, holds_file_lock, touch, \
+    STALE_LOCK_SECONDS
 
 
 logging.basicConfig(format="%(asctime)s [%(levelname)s]| %(message)s", datefmt="%m-%d %H:%M:%S")
 
+# the number of files GitHub returns together with a commit and in every further page of its files
+COMMIT_FILES_PER_PAGE = 300
+
+# cache entries outside of the repository directories are reported under this name
+ROOT_GROUP = "(root)"
+STATS_DIR = "stats"
+
+T = TypeVar("T")
+
+
+@dataclass
+class MissingEntry:
+    """
+    Cached in place of objects GitHub responded with 404 for, so they are not requested again
+    """
+    pass
+
 
 def sanitize_path(raw_repo: str):
     return raw_repo.replace("/", "_")
 
 
+def get_entry_group(root_path: Path, path: Path) -> str:
+    """
+    :return: The name of the top level directory of the cache entry, i.e. the sanitized repository for GitHub objects
+    """
+    parts = path.relative_to(root_path).parts
+    return parts[0] if len(parts) > 1 else ROOT_GROUP
+
+
+@dataclass
+class CacheStats:
+    """
+    The hits and misses of the cache in this process, per top level cache directory
+    """
+    root_path: Path
+    hits: Counter = field(default_factory=Counter)
+    misses: Counter = field(default_factory=Counter)
+
+    def record(self, path: Path, hit: bool) -> None:
+        """
+        Count the access of the cache entry, hit entries are also marked as recently used for eviction
+        """
+        group = get_entry_group(self.root_path, path)
+        if hit:
+            self.hits[group] += 1
+            touch(path)
+        else:
+            self.misses[group] += 1
+
+    def save(self) -> None:
+        """
+        Save the statistics of this process next to the ones of the other processes, so they can be summed up
+        """
+        if not self.hits and not self.misses:
+            return
+
+        stats_path = self.root_path / STATS_DIR / f"{socket.gethostname()}_{os.getpid()}_{int(time.time())}.json"
+        atomic_write_bytes(stats_path, json.dumps({"hits": self.hits, "misses": self.misses}).encode())
+
+
+@cache
+def get_cache_stats(root_path: Path) -> CacheStats:
+    stats = CacheStats(Path(root_path))
+    atexit.register(stats.save)
+    return stats
+
+
 @dataclass
 class Cache:
     gh_access: Github
@@ -36,56 +113,426 @@ class Cache:
 
         return repo_path, repo_pkl_path
 
-    def get_repo(self, repo: str) -> Repository | None:
-        repo_path, repo_pkl_path = self.get_cached_repo_path(repo)
-        if repo_path.exists():
-            with repo_pkl_path.open("rb") as fp:
-                repo_obj = pickle.load(fp)
-        else:
-            try:
-                repo_obj = self.gh_access.get_repo(repo)
-            except RateLimitExceededException:
-                logging.error(f"Rate limit exceeded...Waiting 1 hr, then retrying")
-                time.sleep(60*60)
-                return self.get_repo(repo)
-            except GithubException as ex:
-                logging.error(f"Error retrieving repo {repo}: {ex}")
+    def get_cached(self, pkl_path: Path, fetch: Callable[[], T | None], error_msg: str,
+                   is_valid: Callable[[T], bool] = lambda obj: True) -> T | None:
+        """
+        Get an object from the cache, or fetch and cache it if it is missing. Only one process fetches a missing object,
+        the others wait for it and read the cached object. Entries are written atomically, corrupted entries are
+        fetched again. Transient errors are retried with backoff, objects that do not exist are cached as missing.
+        When the rate limit is exceeded, the outermost call waits for it after releasing its lock, nested calls (e.g.
+        fetching the commit while its files are locked) pass the exception on, so no lock is held while waiting.
+        :param pkl_path: The path of the cached object
+        :param fetch: Fetches the object from GitHub, may return None if the object could not be fetched
+        :param error_msg: Logged together with the exception if the object could not be fetched
+        :param is_valid: Cached objects not satisfying it are fetched again
+        :return: The object, or None if it could not be fetched
+        """
+        lock_path = pkl_path.with_name(f"{pkl_path.name}.lock")
+        stats = get_cache_stats(self.root_path)
+        nested = holds_file_lock()
+        while True:
+            obj = load_cached_pickle(pkl_path)
+            if isinstance(obj, MissingEntry):
+                stats.record(pkl_path, hit=True)
                 return None
+            if obj is not None and is_valid(obj):
+                stats.record(pkl_path, hit=True)
+                return obj
 
-            repo_path.mkdir(parents=True, exist_ok=True)
+            with file_lock(lock_path):
+                # another process may have fetched it while we were waiting for the lock
+                obj = load_cached_pickle(pkl_path)
+                if isinstance(obj, MissingEntry):
+                    return None
+                if obj is not None and is_valid(obj):
+                    stats.record(pkl_path, hit=True)
+                    return obj
 
-            with repo_pkl_path.open("wb") as fp:
-                pickle.dump(repo_obj, fp)
+                stats.record(pkl_path, hit=False)
+                try:
+                    obj = get_transport().retry(fetch)
+                except RateLimitExceededException:
+                    if nested:
+                        raise
+                    obj = None
+                except UnknownObjectException as ex:
+                    logging.error(f"{error_msg}: {ex}")
+                    atomic_save_pickle(MissingEntry(), pkl_path)
+                    return None
+                except (GithubException, *TRANSIENT_REQUEST_EXCEPTIONS) as ex:
+                    # transient errors reach this point only when they persisted through every retry
+                    logging.error(f"{error_msg}: {ex!r}")
+                    return None
+                else:
+                    if obj is not None:
+                        atomic_save_pickle(obj, pkl_path)
+                    return obj
 
-        return repo_obj
+            # the lock is released while waiting, so the other processes are not blocked by the sleeping one
+            logging.error(f"Rate limit exceeded...Waiting 1 hr, then retrying")
+            time.sleep(60 * 60)
 
-    def get_commit(self, repo: str, commit_hash: str) -> Commit | None:
-        repo_path, _ = self.get_cached_repo_path(repo)
+    def get_repo(self, repo: str) -> Repository | None:
+        _, repo_pkl_path = self.get_cached_repo_path(repo)
+        return self.get_cached(repo_pkl_path, lambda: self.gh_access.get_repo(repo), f"Error retrieving repo {repo}")
 
+    def get_commit(self, repo: str, commit_hash: str, on_fetched: Callable[[Commit], None] | None = None) -> \
+            Commit | None:
+        """
+        :param repo: The repository of the commit
+        :param commit_hash: The sha of the commit
+        :param on_fetched: Called with the complete commit (including its first page of files) if it is fetched now
+        :return: The commit without its files, or None if it could not be retrieved
+        """
+        repo_path, _ = self.get_cached_repo_path(repo)
         commit_pkl_path = repo_path / f"{commit_hash}.pkl"
 
-        if commit_pkl_path.exists():
-            with commit_pkl_path.open("rb") as fp:
-                commit_obj = pickle.load(fp)
-        else:
+        def fetch_commit() -> Commit | None:
             repo_obj = self.get_repo(repo)
             if repo_obj is None:
                 return None
-            try:
-                commit_obj = repo_obj.get_commit(commit_hash)
-
-                with commit_pkl_path.open("wb") as fp:
-                    pickle.dump(commit_obj, fp)
-            except RateLimitExceededException:
-                logging.error(f"Rate limit exceeded...Waiting 1 hr, then retrying")
-                time.sleep(60 * 60)
-                return self.get_commit(repo, commit_hash)
-            except GithubException as ex:
-                logging.error(f"Error retrieving commit {commit_hash} from repo {repo}: {ex}")
+            commit_obj = repo_obj.get_commit(commit_hash)
+            if on_fetched is not None:
+                on_fetched(commit_obj)
+            return strip_commit_files(commit_obj)
+
+        return self.get_cached(commit_pkl_path, fetch_commit,
+                               f"Error retrieving commit {commit_hash} from repo {repo}")
+
+    def get_commit_files(self, repo: str, commit_hash: str, file_types: list[str], max_files: int) -> list[File] | None:
+        """
+        Get at most max_files files of the commit that have a patch and end with one of the file types. The files are
+        fetched page by page and the fetching stops as soon as enough files are found. Only the matching files are
+        cached.
+        :param repo: The repository of the commit
+        :param commit_hash: The sha of the commit
+        :param file_types: The accepted file endings
+        :param max_files: The maximum number of files to return
+        :return: The list of matching files, or None if the commit could not be retrieved
+        """
+        repo_path, _ = self.get_cached_repo_path(repo)
+        files_pkl_path = repo_path / f"{commit_hash}_files.pkl"
+        files_filter = (list(file_types), max_files)
+
+        def fetch_files() -> tuple[tuple[list[str], int], list[File]] | None:
+            fetched_commits = []
+            commit_obj = self.get_commit(repo, commit_hash, fetched_commits.append)
+            if commit_obj is None:
                 return None
+            # a commit cached by this version is stripped of its files, so they are requested from the first page,
+            # commits cached by earlier versions still hold their first page
+            first_page = (fetched_commits[0] if fetched_commits else commit_obj).raw_data.get("files")
+            files = iter_filtered_commit_files(commit_obj, file_types, first_page)
+            return files_filter, list(islice(files, max_files))
+
+        cached_files = self.get_cached(files_pkl_path, fetch_files,
+                                       f"Error retrieving files of commit {commit_hash} from repo {repo}",
+                                       lambda cached: cached[0] == files_filter)
+        if cached_files is None:
+            return None
+
+        return cached_files[1]
+
+
+def strip_commit_files(commit: Commit) -> Commit:
+    """
+    Drop the files from a fetched commit, so they are not persisted together with the commit
+    :param commit: The fetched commit
+    :return: A completed commit object without the files
+    """
+    attributes = {key: value for key, value in commit.raw_data.items() if key != "files"}
+    return Commit(commit._requester, commit.raw_headers, attributes, completed=True)
 
-        return commit_obj
+
+def iter_commit_files(commit: Commit, first_page: list[dict] | None = None) -> Iterator[File]:
+    """
+    Lazily iterate over the files of the commit, a new page of files is only requested when the previous one is
+    exhausted
+    :param commit: The commit whose files are iterated
+    :param first_page: The raw files returned together with the commit, None if they are not at hand
+    :return: Iterator of the files
+    """
+    if first_page is None:
+        yield from PaginatedList(File, commit._requester, commit.url, {}, list_item="files")
+        return
+
+    for raw_file in first_page:
+        yield File(commit._requester, commit.raw_headers, raw_file, completed=True)
+    if len(first_page) >= COMMIT_FILES_PER_PAGE:
+        yield from PaginatedList(File, commit._requester, commit.url, {"page": 2}, list_item="files")
+
+
+def iter_filtered_commit_files(commit: Commit, file_types: list[str], first_page: list[dict] | None = None) -> \
+        Iterator[File]:
+    """
+    Lazily iterate over the files of the commit that have a patch and end with one of the file types
+    :param commit: The commit whose files are iterated
+    :param file_types: The accepted file endings
+    :param first_page: The raw files returned together with the commit, None if they are not at hand
+    :return: Iterator of the matching files
+    """
+    for file in iter_commit_files(commit, first_page):
+        if not file.patch:
+            continue
+        if any(file.filename.endswith(file_type) for file_type in file_types):
+            yield file
 
 
 def get_cache():
     return Cache(get_github_instance())
+
+
+@dataclass
+class PatchMemo:
+    """
+    Disk-backed memo of tokenized patches keyed by the hash of the patch text and the tokenizer version, so the same
+    patch content (cherry-picks, backports) is only tokenized once across runs
+    """
+    root_path: Path = None
+    hits: int = 0
+    misses: int = 0
+
+    def __post_init__(self):
+        if self.root_path is None:
+            self.root_path = Path(get_config().cache_path) / "patches"
+
+    def get_patch_path(self, patch: str) -> Path:
+        patch_hash = sha256(f"{TOKENIZER_VERSION}\n{patch}".encode()).hexdigest()
+        return self.root_path / patch_hash[:2] / f"{patch_hash}.pkl"
+
+    def get_tokenized_patch(self, patch: str) -> tuple[list[str], list[str]]:
+        """
+        Get the prepared added and removed lines of the patch, tokenizing it only if it is not memoized yet
+        :param patch: The patch of a file
+        :return: tuple[added_code, removed_code]
+        """
+        patch_path = self.get_patch_path(patch)
+        stats = get_cache_stats(self.root_path.parent)
+        tokenized_patch = load_cached_pickle(patch_path)
+        if tokenized_patch is not None:
+            self.hits += 1
+            stats.record(patch_path, hit=True)
+            return tokenized_patch
+
+        self.misses += 1
+        stats.record(patch_path, hit=False)
+        tokenized_patch = tokenize_patch(patch)
+        atomic_save_pickle(tokenized_patch, patch_path)
+
+        return tokenized_patch
+
+    def get_hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_report(self) -> str:
+        return f"Tokenized patch memo: {self.hits} hits, {self.misses} misses, hit rate {self.get_hit_rate():.2%}"
+
+
+@cache
+def get_patch_memo() -> PatchMemo:
+    """
+    :return: The patch memo shared by the whole run, so the hit statistics are collected in one place
+    """
+    return PatchMemo()
+
+
+@dataclass
+class CacheEntry:
+    path: Path
+    group: str
+    size: int
+    last_used: float
+
+
+def iter_cache_entries(root_path: Path) -> Iterator[CacheEntry]:
+    """
+    Iterate over the cached objects (pickles), the modification time of an entry is the last time it was used
+    :param root_path: The root of the cache
+    :return: Iterator of the cache entries
+    """
+    for dir_path, _, file_names in os.walk(root_path):
+        for file_name in file_names:
+            if not file_name.endswith(".pkl"):
+                continue
+            path = Path(dir_path) / file_name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield CacheEntry(path, get_entry_group(root_path, path), stat.st_size, stat.st_mtime)
+
+
+def get_stats_paths(root_path: Path) -> list[Path]:
+    stats_dir = root_path / STATS_DIR
+    return list(stats_dir.glob("*.json")) if stats_dir.exists() else []
+
+
+def load_cache_stats(root_path: Path, stats_paths: list[Path] | None = None) -> tuple[Counter, Counter]:
+    """
+    Sum up the hit statistics saved by every process
+    :param root_path: The root of the cache
+    :param stats_paths: The statistics files to sum up, every file in the statistics directory if None
+    :return: tuple[hits, misses] per top level cache directory
+    """
+    hits, misses = Counter(), Counter()
+    if stats_paths is None:
+        stats_paths = get_stats_paths(root_path)
+
+    for stats_path in stats_paths:
+        with stats_path.open() as fp:
+            stats = json.load(fp)
+        hits.update(stats["hits"])
+        misses.update(stats["misses"])
+
+    return hits, misses
+
+
+def get_cache_report(root_path: Path) -> str:
+    """
+    Report the number of entries, their size and the hit statistics per top level cache directory
+    :param root_path: The root of the cache
+    :return: The report as a table
+    """
+    counts, sizes = Counter(), Counter()
+    for entry in iter_cache_entries(root_path):
+        counts[entry.group] += 1
+        sizes[entry.group] += entry.size
+    hits, misses = load_cache_stats(root_path)
+
+    rows = [f"{'group':<50} {'entries':>10} {'MiB':>10} {'hits':>10} {'misses':>10}"]
+    for group, size in sizes.most_common():
+        rows.append(f"{group:<50} {counts[group]:>10} {size / 2 ** 20:>10.1f} {hits[group]:>10} {misses[group]:>10}")
+    rows.append(f"{'total':<50} {sum(counts.values()):>10} {sum(sizes.values()) / 2 ** 20:>10.1f} "
+                f"{sum(hits.values()):>10} {sum(misses.values()):>10}")
+
+    return "\n".join(rows)
+
+
+def get_pinned_paths(cache_: Cache, repo_shas: Iterable[tuple[str, str]]) -> set[Path]:
+    """
+    Get the cache entries of the commits in the dataset, these are never evicted
+    :param cache_: The cache
+    :param repo_shas: The (repo, sha) pairs of the dataset
+    :return: The paths of the pinned entries
+    """
+    pinned = set()
+    for repo, sha in repo_shas:
+        repo_path, repo_pkl_path = cache_.get_cached_repo_path(repo)
+        pinned.add(repo_pkl_path)
+        pinned.add(repo_path / f"{sha}.pkl")
+        pinned.add(repo_path / f"{sha}_files.pkl")
+
+    return pinned
+
+
+def evict_cache_entries(root_path: Path, max_bytes: int | None, max_age_days: float | None,
+                        pinned: set[Path]) -> tuple[int, int]:
+    """
+    Remove the entries not used for more than max_age_days, then the least recently used entries until the cache fits
+    into max_bytes. Pinned entries are never removed, but they count towards the size of the cache.
+    :param root_path: The root of the cache
+    :param max_bytes: The size budget of the cache, None for no budget
+    :param max_age_days: Entries not used for longer are removed, None for no age limit
+    :param pinned: The paths of the entries that must be kept
+    :return: tuple[number of removed entries, number of freed bytes]
+    """
+    entries = sorted(iter_cache_entries(root_path), key=lambda entry: entry.last_used)
+    total_size = sum(entry.size for entry in entries)
+    min_last_used = time.time() - max_age_days * 24 * 60 * 60 if max_age_days is not None else None
+
+    n_removed = 0
+    freed = 0
+    for entry in entries:
+        too_old = min_last_used is not None and entry.last_used < min_last_used
+        over_budget = max_bytes is not None and total_size - freed > max_bytes
+        if not too_old and not over_budget:
+            # the entries are ordered by their last use, so every further entry is newer
+            break
+        if entry.path in pinned:
+            continue
+
+        entry.path.unlink(missing_ok=True)
+        n_removed += 1
+        freed += entry.size
+
+    return n_removed, freed
+
+
+def compact_cache(root_path: Path) -> None:
+    """
+    Remove the leftovers of killed processes (temporary files, stale locks) and the empty directories, merge the hit
+    statistics into a single file and deduplicate the lists of urls, so the cache stays fast to traverse. The entries
+    themselves are not repacked. Files and directories touched recently are left alone, so it is safe to run while the
+    cache is in use, except that urls appended to the lists during the deduplication may be lost (and fetched again).
+    :param root_path: The root of the cache
+    :return: None
+    """
+    now = time.time()
+    # taken before anything is removed, as removing a file from a directory updates its modification time
+    dir_mtimes = {}
+    for dir_path, _, file_names in os.walk(root_path):
+        try:
+            dir_mtimes[Path(dir_path)] = Path(dir_path).stat().st_mtime
+        except FileNotFoundError:
+            continue
+        for file_name in file_names:
+            path = Path(dir_path) / file_name
+            try:
+                is_stale = now - path.stat().st_mtime > STALE_LOCK_SECONDS
+            except FileNotFoundError:
+                continue
+            if is_stale and file_name.endswith((".tmp", ".lock", ".stale")):
+                path.unlink(missing_ok=True)
+
+    for dir_path, dir_mtime in sorted(dir_mtimes.items(), key=lambda item: len(item[0].parts), reverse=True):
+        # a running process may have just created the directory to write into it
+        if dir_path == root_path or now - dir_mtime <= STALE_LOCK_SECONDS:
+            continue
+        try:
+            if not any(dir_path.iterdir()):
+                dir_path.rmdir()
+        except OSError:
+            # removed by someone else, or a file was written into it in the meantime
+            continue
+
+    # only the files listed now are merged and removed, the statistics saved in the meantime are kept
+    stats_paths = get_stats_paths(root_path)
+    if stats_paths:
+        hits, misses = load_cache_stats(root_path, stats_paths)
+        atomic_write_bytes(root_path / STATS_DIR / "compacted.json",
+                           json.dumps({"hits": hits, "misses": misses}).encode())
+        for stats_path in stats_paths:
+            if stats_path.name != "compacted.json":
+                stats_path.unlink(missing_ok=True)
+
+    for urls_path in (root_path / "missing_urls.txt", root_path / "skipped_for_size.txt"):
+        if urls_path.exists():
+            lines = dict.fromkeys(urls_path.read_text().splitlines())
+            atomic_write_bytes(urls_path, "".join(f"{line}\n" for line in lines).encode())
+
+
+if __name__ == "__main__":
+    config = get_config()
+    parser = ArgumentParser(description="Inspect and maintain the cache")
+    parser.add_argument("command", choices=["report", "evict", "compact"],
+                        help="report: entries, size and hit statistics per repository, evict: remove the least "
+                             "recently used entries that are not part of the dataset, compact: clean up the cache")
+    parser.add_argument("--max-bytes", type=int, default=config.cache_max_bytes,
+                        help="size budget of the cache, defaults to cache_max_bytes in conf.yaml")
+    parser.add_argument("--max-age-days", type=float, default=config.cache_max_age_days,
+                        help="evict entries not used for this many days, defaults to cache_max_age_days in conf.yaml")
+    args = parser.parse_args()
+
+    cache_root = Path(config.cache_path)
+    if args.command == "report":
+        print(get_cache_report(cache_root))
+    elif args.command == "evict":
+        # imported here, as the miner depends on this module through the commits
+        from miner import get_projectkb_commits
+
+        pinned_paths = get_pinned_paths(get_cache(), ((commit.repo, commit.sha) for commit in get_projectkb_commits()))
+        n_evicted, freed_bytes = evict_cache_entries(cache_root, args.max_bytes, args.max_age_days, pinned_paths)
+        print(f"Evicted {n_evicted} entries, freed {freed_bytes / 2 ** 20:.1f} MiB")
+    else:
+        compact_cache(cache_root)
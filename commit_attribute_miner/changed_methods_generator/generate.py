@@ -1,12 +1,17 @@
 from dataclasses import dataclass
 from pathlib import Path
+import logging
 
 from miner import get_projectkb_commits_top_1, get_mock_commits
-from commit import GHCommit, GHFile
+from commit import GHCommit, GHFile, GHAccessException
 from changed_methods_generator.java_parser import get_methods_by_row_indicies, get_all_methods, \
     are_nodes_with_same_name, get_node_name
 from tree_sitter import Node
 from util import read_file_as_bytes
+from sharding import merge_csv_shards, parse_shard_args
+from transport import TransientError, get_transport
+
+METHOD_PAIRS_RESULT_FILE = "method_pairs.csv"
 
 
 @dataclass()
@@ -24,7 +29,7 @@ class ChangeMethodWriter:
     def init_result_file(self):
         header = "Repository,Before state URL,After state URL,Before state file path,After state file path," \
                  "Before state line:col,After state line:col,Method name,Before state commit hash,After state commit " \
-                 "hash "
+                 "hash\n"
 
         with self.result_file.open("w") as fp:
             fp.write(header)
@@ -46,27 +51,38 @@ class ChangeMethodWriter:
 
     def append_to_result(self):
         result_row = self.get_result_row()
-        pass
+        with self.result_file.open("a") as fp:
+            fp.write(result_row)
 
 
-def generate_method_pairs_for_commits(commits_: list[GHCommit]):
+def generate_method_pairs_for_commits(commits_: list[GHCommit], result_file: Path):
     """
     Generate the pairs of pre and pos commit states of methods for a list of commits
     :param commits_: The list of commits to analyze
+    :param result_file: The csv file the pairs are appended to
     :return: None
     """
     for commit in commits_:
-        commit.load_files()
+        try:
+            commit.load_files()
+            raw_commit = commit.get_raw_commit()
+        except GHAccessException as ex:
+            logging.error(ex)
+            continue
+
         for file in commit.files:
-            pre_commit_file = file.get_pre_commit_state(commit.get_raw_commit())
-            if not pre_commit_file:
-                # we want pairs, so a missing a pre-state makes the file unfit
+            try:
+                states = file.get_pre_post_commit_states(raw_commit)
+            except TransientError as ex:
+                logging.error(f"Error downloading {file.get_path()} of commit {commit.sha}: {ex}")
+                continue
+            if states is None:
+                # we want pairs, so a missing pre- or post-state makes the file unfit
                 continue
 
-            pre_commit_file = pre_commit_file
+            pre_commit_file, post_commit_file = states
 
             changed_line_positions = file.get_changed_line_indexes()
-            post_commit_file = file.get_post_commit_state()
             changed_methods = get_methods_by_row_indicies(post_commit_file,
                                                           changed_line_positions)
             all_pre_commit_methods = get_all_methods(pre_commit_file)
@@ -78,11 +94,39 @@ def generate_method_pairs_for_commits(commits_: list[GHCommit]):
                 if not pre_commit_method:
                     continue
 
-                result_writer = ChangeMethodWriter(commit, post_change_method, pre_commit_method, file, Path(""))
+                result_writer = ChangeMethodWriter(commit, post_change_method, pre_commit_method, file, result_file)
                 result_writer.append_to_result()
 
 
+def merge_method_pairs_shards(commits_: list[GHCommit], count: int, result_file: Path):
+    """
+    Merge the csv files of the shards into the csv file a single-node run would produce, the rows are ordered by the
+    position of their commit in the work list
+    :param commits_: The whole work list
+    :param count: The number of shards
+    :param result_file: The csv file of a single-node run
+    :return: None
+    """
+    commit_positions = {}
+    for pos, commit in enumerate(commits_):
+        commit_positions.setdefault((commit.repo, commit.sha), pos)
+
+    # the first column is the repository, the last one is the hash of the commit
+    merge_csv_shards(count, result_file,
+                     lambda row: commit_positions[(row.split(",")[0], row.rstrip("\n").split(",")[-1])])
+
+
 if __name__ == "__main__":
+    args = parse_shard_args("Generate the pre and post commit states of the changed methods")
     commits = get_mock_commits()
-    generate_method_pairs_for_commits(commits)
-    pass
+    if args.merge:
+        merge_method_pairs_shards(commits, args.merge, Path(METHOD_PAIRS_RESULT_FILE))
+    elif args.shard:
+        _, commits = args.shard.select(commits)
+        generate_method_pairs_for_commits(commits, args.shard.get_path(METHOD_PAIRS_RESULT_FILE))
+    else:
+        generate_method_pairs_for_commits(commits, Path(METHOD_PAIRS_RESULT_FILE))
+
+    transport_report = get_transport().get_report()
+    if transport_report:
+        print(transport_report)
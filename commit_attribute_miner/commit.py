@@ -6,14 +6,20 @@ import re
 from github.File import File
 from github.Commit import Commit
 
-from util import get_lines_from_patch, prepare_cc2vec_input, get_file_content_from_url, save_commit2vec_file
+from util import get_file_content_from_url, save_commit2vec_file
 from config import Config, get_config
-from cache import Cache, get_cache
+from cache import Cache, get_cache, get_patch_memo
+from vocabulary import FileTokens, to_cc2vec_codes
+from commit2vec_store import Commit2VecStore
+from transport import TransientError
 
 logging.basicConfig(format="%(asctime)s [%(levelname)s]| %(message)s", datefmt="%m-%d %H:%M:%S")
 
 
 class GHAccessException(Exception):
+    """
+    The commit or its files could not be retrieved from GitHub, so nothing should be recorded for it
+    """
     pass
 
 
@@ -21,15 +27,20 @@ class GHAccessException(Exception):
 class GHFile:
     gh_file: File
 
-    def get_removed_code(self) -> list[str]:
+    def get_changed_code(self) -> tuple[list[str], list[str]]:
+        """
+        Get the added and removed lines of the patch prepared for cc2vec, repeated patch contents are tokenized once
+        :return: tuple[added_code, removed_code]
+        """
         if not self.gh_file.patch:
-            return []
-        return prepare_cc2vec_input(get_lines_from_patch(self.gh_file.patch, "-"))
+            return [], []
+        return get_patch_memo().get_tokenized_patch(self.gh_file.patch)
+
+    def get_removed_code(self) -> list[str]:
+        return self.get_changed_code()[1]
 
     def get_added_code(self) -> list[str]:
-        if not self.gh_file.patch:
-            return []
-        return prepare_cc2vec_input(get_lines_from_patch(self.gh_file.patch, "+"))
+        return self.get_changed_code()[0]
 
     def get_changed_line_indexes(self):
         """
@@ -77,13 +88,27 @@ class GHFile:
         """
         if not commit.parents:
             return None
-
-        pre_commit_url = self.get_pre_commit_url(commit.parents[0].sha)
-        return get_file_content_from_url(pre_commit_url)
+        return get_file_content_from_url(self.get_pre_commit_url(commit.parents[0].sha))
 
     def get_post_commit_state(self) -> bytes | None:
         return get_file_content_from_url(self.gh_file.raw_url)
 
+    def get_pre_post_commit_states(self, commit: Commit) -> tuple[bytes, bytes] | None:
+        """
+        Get both states of the file. The post-commit state is downloaded first, if it is missing or it was skipped for
+        its size, the pre-commit state is not downloaded at all.
+        :param commit: The commit that contains this file
+        :return: tuple[pre-commit state, post-commit state], or None if either of them is missing or was skipped
+        """
+        post_state = self.get_post_commit_state()
+        if not post_state:
+            return None
+        pre_state = self.get_pre_commit_state(commit)
+        if not pre_state:
+            return None
+
+        return pre_state, post_state
+
     def get_url(self) -> str:
         return self.gh_file.raw_url
 
@@ -94,8 +119,11 @@ class CommitAttributes:
     files: list[GHFile]
     message: str
 
+    def get_files_tokens(self) -> list[FileTokens]:
+        return [FileTokens(*file.get_changed_code()) for file in self.files]
+
     def get_files_cc2vec_flattened(self) -> list[dict[str, list[str]]]:
-        return [{"added_code": file.get_added_code(), "removed_code": file.get_removed_code()} for file in self.files]
+        return to_cc2vec_codes([self.get_files_tokens()])[0]
 
 
 @dataclass
@@ -121,13 +149,7 @@ class GHCommit:
         Load the files in the commit
         :return: None
         """
-        self.files = []
-        files = self.get_filtered_commit_files()
-        for file in files:
-            if not file.patch:
-                continue
-
-            self.files.append(GHFile(file))
+        self.files = [GHFile(file) for file in self.get_filtered_commit_files()]
 
     def __post_init__(self):
         self.config = get_config()
@@ -135,35 +157,50 @@ class GHCommit:
 
     def get_filtered_commit_files(self) -> list[File]:
         """
-        :return: filtered list of commit files based on the filtering specified in the config
+        :return: filtered list of commit files based on the filtering specified in the config, files without a patch are
+        skipped
+        :raises GHAccessException: If the files could not be retrieved
         """
-        commit = self.cache.get_commit(self.repo, self.sha)
-        files = [file for file in commit.files if any(file.filename.endswith(file_type) for file_type in
-                                                      self.config.file_types)][:self.config.max_files]
+        files = self.cache.get_commit_files(self.repo, self.sha, self.config.file_types, self.config.max_files)
+        if files is None:
+            raise GHAccessException(f"Could not retrieve the files of commit {self.sha} from repo {self.repo}")
 
         return files
 
     def get_raw_commit(self) -> Commit:
-        return self.cache.get_commit(self.repo, self.sha)
+        """
+        :raises GHAccessException: If the commit could not be retrieved
+        """
+        commit = self.cache.get_commit(self.repo, self.sha)
+        if commit is None:
+            raise GHAccessException(f"Could not retrieve commit {self.sha} from repo {self.repo}")
+
+        return commit
 
     def get_parent(self) -> Commit:
         """
         Get the parent commit
         :return: Commit object
         """
-        return self.cache.get_commit(self.repo, self.sha).parents[0]
+        return self.get_raw_commit().parents[0]
 
     def get_message(self) -> str:
         """
         Get the commit message
         :return: Commit message as string
         """
-        commit = self.cache.get_commit(self.repo, self.sha)
-        return commit.commit.message
+        return self.get_raw_commit().commit.message
 
     def get_attributes(self) -> CommitAttributes | None:
-        self.safe_load_files()
-        return CommitAttributes(self.sha, self.files, self.get_message())
+        """
+        :return: The attributes of the commit, or None if the commit could not be retrieved
+        """
+        try:
+            self.safe_load_files()
+            return CommitAttributes(self.sha, self.files, self.get_message())
+        except (TransientError, GHAccessException) as ex:
+            logging.error(ex)
+            return None
 
     def get_commit2vec_files_path(self, path_: str) -> Path:
         """
@@ -172,46 +209,75 @@ class GHCommit:
         :return: Path object for the directory of commit2vec file pairs
         """
         repo_str = self.repo.replace('/', '_')
-        commit2vec_files_path = Path(path_) / f"{repo_str}_{self.sha}"
-        commit2vec_files_path.mkdir(parents=True, exist_ok=True)
-
-        return commit2vec_files_path
+        return Path(path_) / f"{repo_str}_{self.sha}"
 
     def save_pre_post_files(self, path_: str) -> bool:
         """
-        Save the pre and post versions of files, return if any pair was saved
+        Save the pre and post versions of files, return if any pair was saved. Commits saved by an earlier run are not
+        loaded again, and nothing is written until every pair of the commit is downloaded.
         :param path_: The root to all commit2vec files
         :return: Boolean representing if any pre post was found
+        :raises GHAccessException: If the commit or its files could not be retrieved
+        :raises TransientError: If a file could not be downloaded
         """
-        self.safe_load_files()
         commit2vec_files_path = self.get_commit2vec_files_path(path_)
-        n_files = len(list(commit2vec_files_path.glob("*")))
-        if n_files > 0:
+        if commit2vec_files_path.exists() and any(commit2vec_files_path.iterdir()):
             return True
 
-        pair_found = False
+        self.safe_load_files()
+        raw_commit = self.get_raw_commit()
+        pairs = []
         for file in self.files:
-            pre_state = file.get_pre_commit_state(self.get_raw_commit())
-            if not pre_state:
-                continue
-            post_state = file.get_post_commit_state()
+            states = file.get_pre_post_commit_states(raw_commit)
+            if states is not None:
+                pairs.append((file.get_filename(), *states))
 
-            save_commit2vec_file(commit2vec_files_path / f"pre_{file.get_filename()}", pre_state)
-            save_commit2vec_file(commit2vec_files_path / f"post_{file.get_filename()}", post_state)
-            pair_found = True
+        for filename, pre_state, post_state in pairs:
+            commit2vec_files_path.mkdir(parents=True, exist_ok=True)
+            save_commit2vec_file(commit2vec_files_path / f"pre_{filename}", pre_state)
+            save_commit2vec_file(commit2vec_files_path / f"post_{filename}", post_state)
 
-        return pair_found
+        return bool(pairs)
 
     def save_pre_post_files_pairs(self, path_: str | Path):
         """
         Save the pre and post versions of files but only if both states exists
         :return: None
         """
-        self.safe_load_files()
-        pair_found = self.save_pre_post_files(path_)
+        try:
+            self.save_pre_post_files(path_)
+        except (TransientError, GHAccessException) as ex:
+            # nothing was written for the commit, so it is processed again in the next run
+            logging.error(f"Error saving the files of commit {self.sha} from repo {self.repo}: {ex}")
 
-        if not pair_found:
-            self.get_commit2vec_files_path(path_).rmdir()
+    def save_pre_post_files_to_store(self, store: Commit2VecStore) -> bool:
+        """
+        Save the pre and post versions of files into the content-addressed store, keyed by their full paths, so files
+        with the same name in different directories do not overwrite each other
+        :param store: The store of the commit2vec files
+        :return: Boolean representing if any pre post pair was found
+        """
+        if store.is_exported(self.repo, self.sha):
+            return store.has_pairs(self.repo, self.sha)
+
+        pairs = []
+        try:
+            self.safe_load_files()
+            raw_commit = self.get_raw_commit()
+            for file in self.files:
+                states = file.get_pre_post_commit_states(raw_commit)
+                if states is None:
+                    continue
+
+                pre_state, post_state = states
+                pairs.append((file.get_pre_commit_path(), pre_state, file.get_path(), post_state))
+        except (TransientError, GHAccessException) as ex:
+            # the commit is not recorded in the manifest, so it is processed again in the next run
+            logging.error(f"Error saving the files of commit {self.sha} from repo {self.repo}: {ex}")
+            return False
+
+        store.save_commit_pairs(self.repo, self.sha, pairs)
+        return bool(pairs)
 
     def get_parent_sha(self) -> str:
         return self.get_parent().sha
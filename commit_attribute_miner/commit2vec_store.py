@@ -0,0 +1,142 @@
+from dataclasses import dataclass, field
+from hashlib import sha256
+from pathlib import Path
+import json
+import logging
+import os
+import shutil
+
+from storage import atomic_write_bytes
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+@dataclass
+class Commit2VecStore:
+    """
+    Content-addressed store of the pre and post commit file states. Every distinct file content is saved once as a blob
+    named by its hash, and the manifest maps each exported commit to the full paths of its file pairs and their blobs.
+    """
+    root_path: Path
+    exported: dict[str, list[dict[str, str]]] = field(init=False, default_factory=dict)
+    # the manifest ends with a partially written record, the next record has to start on a new line
+    needs_newline: bool = field(init=False, default=False)
+
+    def __post_init__(self):
+        self.root_path = Path(self.root_path)
+        self.root_path.mkdir(parents=True, exist_ok=True)
+        self.load_manifest()
+
+    @staticmethod
+    def get_commit_key(repo: str, sha: str) -> str:
+        return f"{repo}@{sha}"
+
+    def get_manifest_path(self) -> Path:
+        return self.root_path / MANIFEST_NAME
+
+    def get_blob_path(self, blob_hash: str) -> Path:
+        return self.root_path / "blobs" / blob_hash[:2] / blob_hash
+
+    def load_manifest(self) -> None:
+        """
+        Load the exported commits, records that were only partially written (the process was killed while appending
+        them) are skipped, so those commits are exported again
+        :return: None
+        """
+        manifest_path = self.get_manifest_path()
+        if not manifest_path.exists():
+            return
+
+        with manifest_path.open("rb") as fp:
+            content = fp.read()
+        self.needs_newline = bool(content) and not content.endswith(b"\n")
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                self.exported[self.get_commit_key(entry["repo"], entry["sha"])] = entry["pairs"]
+            except (ValueError, KeyError, TypeError) as ex:
+                logging.error(f"Skipping a corrupted record of {manifest_path}: {ex!r}")
+
+    def is_exported(self, repo: str, sha: str) -> bool:
+        return self.get_commit_key(repo, sha) in self.exported
+
+    def has_pairs(self, repo: str, sha: str) -> bool:
+        return bool(self.exported.get(self.get_commit_key(repo, sha)))
+
+    def save_blob(self, content: bytes) -> str:
+        """
+        Save the content, unless a blob with the same content already exists
+        :param content: The file content
+        :return: The hash of the content
+        """
+        blob_hash = sha256(content).hexdigest()
+        blob_path = self.get_blob_path(blob_hash)
+        if not blob_path.exists():
+            atomic_write_bytes(blob_path, content)
+
+        return blob_hash
+
+    def load_blob(self, blob_hash: str) -> bytes:
+        with self.get_blob_path(blob_hash).open("rb") as fp:
+            return fp.read()
+
+    def save_commit_pairs(self, repo: str, sha: str, pairs: list[tuple[str, bytes, str, bytes]]) -> None:
+        """
+        Save the file pairs of a commit and record the commit in the manifest. Commits without pairs are recorded too,
+        so they are not processed again.
+        :param repo: The repository of the commit
+        :param sha: The sha of the commit
+        :param pairs: List of (pre-commit path, pre-commit state, post-commit path, post-commit state)
+        :return: None
+        """
+        manifest_pairs = [{"pre_path": pre_path, "pre": self.save_blob(pre_state),
+                           "post_path": post_path, "post": self.save_blob(post_state)}
+                          for pre_path, pre_state, post_path, post_state in pairs]
+
+        self.add_to_manifest(repo, sha, manifest_pairs)
+
+    def add_to_manifest(self, repo: str, sha: str, manifest_pairs: list[dict[str, str]]) -> None:
+        """
+        Append the record of a commit to the manifest with a single write, and wait until it is on the disk
+        """
+        record = json.dumps({"repo": repo, "sha": sha, "pairs": manifest_pairs}) + "\n"
+        if self.needs_newline:
+            record = "\n" + record
+        fd = os.open(self.get_manifest_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, record.encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.needs_newline = False
+        self.exported[self.get_commit_key(repo, sha)] = manifest_pairs
+
+    def merge(self, other: "Commit2VecStore") -> None:
+        """
+        Add the commits exported into another store (e.g. by another shard) to this one, blobs already in this store are
+        not copied again
+        :param other: The store to merge
+        :return: None
+        """
+        for commit_key, manifest_pairs in other.exported.items():
+            if commit_key in self.exported:
+                continue
+
+            for pair in manifest_pairs:
+                for blob_hash in (pair["pre"], pair["post"]):
+                    blob_path = self.get_blob_path(blob_hash)
+                    if not blob_path.exists():
+                        blob_path.parent.mkdir(parents=True, exist_ok=True)
+                        shutil.copyfile(other.get_blob_path(blob_hash), blob_path)
+
+            repo, sha = commit_key.rsplit("@", 1)
+            self.add_to_manifest(repo, sha, manifest_pairs)
+
+    def get_commit_pairs(self, repo: str, sha: str) -> list[tuple[str, bytes, str, bytes]]:
+        """
+        :return: List of (pre-commit path, pre-commit state, post-commit path, post-commit state) of the commit
+        """
+        return [(pair["pre_path"], self.load_blob(pair["pre"]), pair["post_path"], self.load_blob(pair["post"]))
+                for pair in self.exported[self.get_commit_key(repo, sha)]]
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Literal
 from pathlib import Path
 import yaml
 
@@ -7,7 +8,15 @@ class Config(BaseModel):
     max_files: int
     file_types: list[str]
     cache_path: str
+    cache_max_bytes: int | None
+    cache_max_age_days: float | None
+    download_max_retries: int
+    download_timeout_seconds: int
+    max_file_bytes: int
+    github_access_mode: Literal["live", "record", "replay"]
+    replay_archive_path: str
     src_dataset_path: str
+    commit2vec_export_mode: Literal["directory", "store"]
 
     train_test_ratio: float
     data_path: str
@@ -17,6 +26,10 @@ class Config(BaseModel):
     data_dextend_test_path: str
     f1_scores_dir_path: str
 
+    dictionary_path: str
+    dictionary_min_freq: int
+    dictionary_max_size: int | None
+
     def adjust_file_types(self):
         if "any" in self.file_types:
             # change file_types to empty string, so every filename will satisfy as every string ends with an empty
@@ -27,9 +40,14 @@ class Config(BaseModel):
         if self.cache_path.lower() == "default":
             self.cache_path = str((Path(__file__).parent.parent / "cache").resolve())
 
+    def adjust_replay_archive_root(self):
+        if self.replay_archive_path.lower() == "default":
+            self.replay_archive_path = str((Path(__file__).parent.parent / "replay_archive").resolve())
+
     def adjust_self(self):
         self.adjust_file_types()
         self.adjust_cache_root()
+        self.adjust_replay_archive_root()
 
 
 def get_config(conf_path=None):
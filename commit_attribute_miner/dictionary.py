@@ -0,0 +1,160 @@
+from array import array
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from util import save_pickle
+from vocabulary import FileTokens, Vocabulary, VOCABULARY
+
+# the token cc2vec maps every unknown word to
+NULL_TOKEN = "<NULL>"
+
+
+@dataclass
+class TokenCounts:
+    """
+    Mergeable token frequencies, message tokens are counted as strings, code tokens by their vocabulary id
+    """
+    msg_counts: Counter = field(default_factory=Counter)
+    code_counts: Counter = field(default_factory=Counter)
+
+    def merge(self, other: "TokenCounts") -> "TokenCounts":
+        self.msg_counts.update(other.msg_counts)
+        self.code_counts.update(other.code_counts)
+        return self
+
+    def remap(self, id_map: array) -> None:
+        """
+        Move the code token counts to another vocabulary
+        :param id_map: Array mapping the current token ids to the ids in the other vocabulary
+        :return: None
+        """
+        self.code_counts = Counter({id_map[token_id]: count for token_id, count in self.code_counts.items()})
+
+
+def count_tokens(messages: list[str], code_token_ids: list[array]) -> TokenCounts:
+    """
+    Count the tokens of a batch of commits, runs in a worker process
+    :param messages: The commit messages of the batch
+    :param code_token_ids: The token id arrays of the added and removed code of the files in the batch
+    :return: The token counts of the batch
+    """
+    counts = TokenCounts()
+    for message in messages:
+        counts.msg_counts.update(message.lower().split())
+    for token_ids in code_token_ids:
+        counts.code_counts.update(token_ids)
+
+    return counts
+
+
+@dataclass
+class DictionaryBuilder:
+    """
+    Counts the message and code tokens of the commits while they are mined. The commits are collected into batches and
+    every full batch is counted by a worker process, so counting does not hold up the mining.
+    """
+    n_workers: int | None = None
+    batch_size: int = 256
+
+    counts: TokenCounts = field(init=False, default_factory=TokenCounts)
+    pool: ProcessPoolExecutor = field(init=False)
+    futures: list[Future] = field(init=False, default_factory=list)
+    batch_messages: list[str] = field(init=False, default_factory=list)
+    batch_codes: list[array] = field(init=False, default_factory=list)
+
+    def __post_init__(self):
+        self.pool = ProcessPoolExecutor(self.n_workers)
+
+    def add(self, message: str, code: list[FileTokens]) -> None:
+        """
+        Add the tokens of a commit to be counted
+        :param message: The commit message
+        :param code: The changed files of the commit
+        :return: None
+        """
+        self.batch_messages.append(message)
+        for file in code:
+            self.batch_codes.append(file.added_code.token_ids)
+            self.batch_codes.append(file.removed_code.token_ids)
+
+        if len(self.batch_messages) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Send the collected batch to a worker process
+        :return: None
+        """
+        if not self.batch_messages:
+            return
+
+        self.futures.append(self.pool.submit(count_tokens, self.batch_messages, self.batch_codes))
+        self.batch_messages = []
+        self.batch_codes = []
+        self.collect(block=False)
+
+    def collect(self, block: bool = True) -> None:
+        """
+        Merge the counts of the finished batches
+        :param block: Wait for all the batches to finish
+        :return: None
+        """
+        pending = []
+        for future in self.futures:
+            if block or future.done():
+                self.counts.merge(future.result())
+            else:
+                pending.append(future)
+
+        self.futures = pending
+
+    def get_counts(self) -> TokenCounts:
+        """
+        Count the remaining batches and shut the worker processes down
+        :return: The token counts of every added commit
+        """
+        self.flush()
+        self.collect()
+        self.pool.shutdown()
+        return self.counts
+
+
+def get_token_dict(counts: Counter, min_freq: int, max_size: int | None) -> dict[str, int]:
+    """
+    Create a token -> index mapping of the most frequent tokens, index 0 is reserved for the unknown token. Tokens of
+    the same frequency are ordered alphabetically, so the mapping does not depend on the order they were counted in.
+    :param counts: The token frequencies
+    :param min_freq: Tokens occurring less times are left out
+    :param max_size: The maximum number of tokens in the mapping (excluding the unknown token), None for no limit
+    :return: The mapping of tokens
+    """
+    tokens = [token for token, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+              if count >= min_freq][:max_size]
+
+    token_dict = {NULL_TOKEN: 0}
+    token_dict.update({token: idx for idx, token in enumerate(tokens, start=1)})
+
+    return token_dict
+
+
+def build_dictionary(counts: TokenCounts, min_freq: int = 1, max_size: int | None = None,
+                     vocabulary: Vocabulary = VOCABULARY) -> tuple[dict[str, int], dict[str, int]]:
+    """
+    Build the message and code dictionaries in the format jit_cc2ftr.py expects, the tokens are lowercased, so tokens
+    differing only in case share an index
+    :param counts: The token counts of the commits
+    :param min_freq: Tokens occurring less times are left out
+    :param max_size: The maximum number of tokens in each dictionary, None for no limit
+    :param vocabulary: The vocabulary the code token ids belong to
+    :return: tuple[dict_msg, dict_code]
+    """
+    code_counts = Counter()
+    for token_id, count in counts.code_counts.items():
+        code_counts[vocabulary.tokens[token_id].lower()] += count
+    return get_token_dict(counts.msg_counts, min_freq, max_size), get_token_dict(code_counts, min_freq, max_size)
+
+
+def save_dictionary(counts: TokenCounts, save_path: Path, min_freq: int = 1, max_size: int | None = None) -> None:
+    save_pickle(build_dictionary(counts, min_freq, max_size), save_path)
@@ -1,9 +1,73 @@
+from pathlib import Path
+import logging
+import shutil
+
 from miner import get_projectkb_commits_top_1
+from config import get_config
+from commit import GHCommit
+from commit2vec_store import Commit2VecStore
+from sharding import get_all_shards, parse_shard_args
+from transport import get_transport
 
 COMMIT2VEC_FILES_ROOT = "F:/work/kutatas/code_change_repr/compare_cgange_reprs/commit_attribute_miner/results/commit2vec"
+COMMIT2VEC_STORE_ROOT = \
+    "F:/work/kutatas/code_change_repr/compare_cgange_reprs/commit_attribute_miner/results/commit2vec_store"
+
+
+def get_commit2vec_root() -> str:
+    """
+    :return: The root of the commit2vec files in the configured export mode, the two modes never share a root
+    """
+    return COMMIT2VEC_STORE_ROOT if get_config().commit2vec_export_mode == "store" else COMMIT2VEC_FILES_ROOT
+
+
+def save_commit2vec_files(commits: list[GHCommit], root: str | Path) -> None:
+    if get_config().commit2vec_export_mode == "store":
+        store = Commit2VecStore(root)
+        for commit in commits:
+            commit.save_pre_post_files_to_store(store)
+    else:
+        for commit in commits:
+            commit.save_pre_post_files_pairs(root)
+
+
+def merge_commit2vec_shards(count: int, root: str | Path) -> None:
+    """
+    Merge the commit2vec files saved by the shards into the root of a single-node run
+    :param count: The number of shards
+    :param root: The root to all commit2vec files
+    :return: None
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    store = Commit2VecStore(root) if get_config().commit2vec_export_mode == "store" else None
+    for shard in get_all_shards(count):
+        shard_root = shard.get_path(root)
+        if not shard_root.exists():
+            # a shard that saved no files may not have created its root
+            logging.error(f"Skipping shard {shard.index}/{shard.count}: {shard_root} does not exist")
+            continue
+        if store is not None:
+            store.merge(Commit2VecStore(shard_root))
+            continue
+
+        # every commit has its own directory, so the shards never share one
+        for commit_dir in shard_root.iterdir():
+            if not (root / commit_dir.name).exists():
+                shutil.move(commit_dir, root / commit_dir.name)
+
 
 if __name__ == "__main__":
-    commits = get_projectkb_commits_top_1()
-    for commit in commits:
-        commit.save_pre_post_files_pairs(COMMIT2VEC_FILES_ROOT)
-    pass
+    args = parse_shard_args("Save the pre and post commit states of the changed files for commit2vec")
+    commit2vec_root = get_commit2vec_root()
+    if args.merge:
+        merge_commit2vec_shards(args.merge, commit2vec_root)
+    elif args.shard:
+        _, commits = args.shard.select(get_projectkb_commits_top_1())
+        save_commit2vec_files(commits, args.shard.get_path(commit2vec_root))
+    else:
+        save_commit2vec_files(get_projectkb_commits_top_1(), commit2vec_root)
+
+    transport_report = get_transport().get_report()
+    if transport_report:
+        print(transport_report)
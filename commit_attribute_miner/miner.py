@@ -1,9 +1,15 @@
 from commit import GHCommit
+from cache import get_patch_memo
 import yaml
 from config import get_config
 from pathlib import Path
-from util import save_pickle, create_dextend_codes
+from util import save_pickle, save_streamed_pickle, load_pickle, create_dextend_codes, StreamedList
+from vocabulary import FileTokens, iter_cc2vec_codes, VOCABULARY
+from dictionary import DictionaryBuilder, TokenCounts, save_dictionary
+from sharding import Shard, get_all_shards, get_kept_positions, parse_shard_args
+from transport import get_transport
 from random import shuffle
+import logging
 
 CONFIG = get_config()
 
@@ -64,9 +70,14 @@ def get_mock_commits() -> list[GHCommit]:
                      1)]
 
 
-def get_cc2vec_attributes(commits: list[GHCommit]) -> tuple[list[str], list[str], list[str], dict[str, list[str]]]:
+def get_cc2vec_attributes(commits: list[GHCommit], dictionary_builder: DictionaryBuilder | None = None) -> \
+        tuple[list[str], list[str], list[str], list[list[FileTokens]]]:
     """
-    Get the attributes for a list a commits in a way that CC2VEC can be trained on the features
+    Get the attributes for a list a commits in a way that CC2VEC can be trained on the features. The codes are kept in
+    the compact token representation, use save_cc2vec_pickle to write them in the format CC2VEC expects. Commits that
+    could not be retrieved are left out and their number is logged.
+    :param commits: The commits to mine
+    :param dictionary_builder: If given, the tokens of every mined commit are counted by it
     :return: tuple[commits_ids, commit_labels, commit_messages, commit_codes]
     """
     ids = []
@@ -74,20 +85,45 @@ def get_cc2vec_attributes(commits: list[GHCommit]) -> tuple[list[str], list[str]
     messages = []
     codes = []
 
+    n_unretrieved = 0
     for commit_ in commits:
         attributes = commit_.get_attributes()
-        file_modifications = attributes.get_files_cc2vec_flattened()
+        if attributes is None:
+            n_unretrieved += 1
+            continue
+
+        file_modifications = attributes.get_files_tokens()
         if not file_modifications:
             continue
 
-        messages.append(" ".join(attributes.message.split()))
+        message = " ".join(attributes.message.split())
+        if dictionary_builder is not None:
+            dictionary_builder.add(message, file_modifications)
+
+        messages.append(message)
         codes.append(file_modifications)
         labels.append(int(commit_.label))
         ids.append(commit_.sha)
 
+    if n_unretrieved:
+        logging.error(f"Skipped {n_unretrieved} of {len(commits)} commits that could not be retrieved")
+
     return ids, labels, messages, codes
 
 
+def save_cc2vec_pickle(attributes: tuple[list[str], list[str], list[str], list[list[FileTokens]]],
+                       save_path: Path) -> None:
+    """
+    Save the attributes with the codes converted to the nested list format CC2VEC is trained on. The codes are converted
+    and written one commit at a time, so the converted codes are never held in memory together.
+    :param attributes: tuple[commits_ids, commit_labels, commit_messages, commit_codes]
+    :param save_path: The path of the pickle
+    :return: None
+    """
+    ids, labels, messages, codes = attributes
+    save_streamed_pickle((ids, labels, messages, StreamedList(iter_cc2vec_codes(codes, VOCABULARY))), save_path)
+
+
 def shuffle_lists(*lists):
     l = list(zip(*lists))
 
@@ -95,9 +131,9 @@ def shuffle_lists(*lists):
     return zip(*l)
 
 
-def split_to_train_test_cc2vec(attributes: tuple[list[str], list[str], list[str], dict[str, list[str]]]) -> \
-        tuple[tuple[list[str], list[str], list[str], dict[str, list[str]]],
-              tuple[list[str], list[str], list[str], dict[str, list[str]]]]:
+def split_to_train_test_cc2vec(attributes: tuple[list[str], list[str], list[str], list[list[FileTokens]]]) -> \
+        tuple[tuple[list[str], list[str], list[str], list[list[FileTokens]]],
+              tuple[list[str], list[str], list[str], list[list[FileTokens]]]]:
     shuffled_ids, shuffled_labels, shuffled_messages, shuffled_codes = shuffle_lists(*attributes)
     split_pos = int(len(shuffled_ids) * CONFIG.train_test_ratio)
 
@@ -108,16 +144,84 @@ def split_to_train_test_cc2vec(attributes: tuple[list[str], list[str], list[str]
     return train_set, test_set
 
 
-if __name__ == '__main__':
-    cc2vec_attributes = get_cc2vec_attributes(get_projectkb_commits())
-    save_pickle(cc2vec_attributes, Path(CONFIG.data_path))
+def save_cc2vec_outputs(cc2vec_attributes: tuple[list[str], list[str], list[str], list[list[FileTokens]]],
+                        token_counts: TokenCounts) -> None:
+    """
+    Save the mined attributes, the dictionary and the train/test splits of a whole run
+    :param cc2vec_attributes: tuple[commits_ids, commit_labels, commit_messages, commit_codes]
+    :param token_counts: The token counts of the mined attributes
+    :return: None
+    """
+    save_cc2vec_pickle(cc2vec_attributes, Path(CONFIG.data_path))
+    save_dictionary(token_counts, Path(CONFIG.dictionary_path), CONFIG.dictionary_min_freq, CONFIG.dictionary_max_size)
 
     train_set, test_set = split_to_train_test_cc2vec(cc2vec_attributes)
-    save_pickle(train_set, Path(CONFIG.data_train_path))
-    save_pickle(test_set, Path(CONFIG.data_test_path))
+    save_cc2vec_pickle(train_set, Path(CONFIG.data_train_path))
+    save_cc2vec_pickle(test_set, Path(CONFIG.data_test_path))
 
     dextend_codes_train = create_dextend_codes(train_set[3])
     save_pickle((train_set[0], train_set[1], train_set[2], dextend_codes_train), Path(CONFIG.data_dextend_train_path))
 
     dextend_codes_test = create_dextend_codes(test_set[3])
     save_pickle((test_set[0], test_set[1], test_set[2], dextend_codes_test), Path(CONFIG.data_dextend_test_path))
+
+
+def save_cc2vec_shard(shard: Shard, commits: list[GHCommit]) -> None:
+    """
+    Mine the attributes of the commits in the shard and save them with everything needed to merge the shards later
+    :param shard: The shard to mine
+    :param commits: The whole work list
+    :return: None
+    """
+    positions, shard_commits = shard.select(commits)
+    dictionary_builder = DictionaryBuilder()
+    cc2vec_attributes = get_cc2vec_attributes(shard_commits, dictionary_builder)
+    print(get_patch_memo().get_report())
+
+    kept_positions = get_kept_positions(positions, shard_commits, cc2vec_attributes[0])
+    save_pickle((kept_positions, cc2vec_attributes, VOCABULARY.tokens, dictionary_builder.get_counts()),
+                shard.get_path(CONFIG.data_path))
+
+
+def merge_cc2vec_shards(count: int) -> tuple[tuple[list[str], list[str], list[str], list[list[FileTokens]]],
+                                             TokenCounts]:
+    """
+    Merge the saved shards into the attributes and token counts a single-node run would produce
+    :param count: The number of shards
+    :return: tuple[cc2vec_attributes, token_counts]
+    """
+    merged = []
+    token_counts = TokenCounts()
+    for shard in get_all_shards(count):
+        positions, cc2vec_attributes, tokens, shard_counts = load_pickle(shard.get_path(CONFIG.data_path))
+
+        # the token ids of every shard refer to the vocabulary of the process that mined it
+        id_map = VOCABULARY.get_id_map(tokens)
+        for code in cc2vec_attributes[3]:
+            for file in code:
+                file.remap(id_map)
+        shard_counts.remap(id_map)
+        token_counts.merge(shard_counts)
+
+        merged.extend(zip(positions, *cc2vec_attributes))
+
+    merged.sort(key=lambda entry: entry[0])
+    ids, labels, messages, codes = ([entry[idx] for entry in merged] for idx in range(1, 5))
+    return (ids, labels, messages, codes), token_counts
+
+
+if __name__ == '__main__':
+    args = parse_shard_args("Mine the cc2vec attributes of the ProjectKB commits")
+    if args.shard:
+        save_cc2vec_shard(args.shard, get_projectkb_commits())
+    elif args.merge:
+        save_cc2vec_outputs(*merge_cc2vec_shards(args.merge))
+    else:
+        dictionary_builder = DictionaryBuilder()
+        cc2vec_attributes = get_cc2vec_attributes(get_projectkb_commits(), dictionary_builder)
+        print(get_patch_memo().get_report())
+        save_cc2vec_outputs(cc2vec_attributes, dictionary_builder.get_counts())
+
+    transport_report = get_transport().get_report()
+    if transport_report:
+        print(transport_report)
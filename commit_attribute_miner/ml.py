@@ -3,8 +3,12 @@ from dataclasses import dataclass, field
 from pathlib import Path
 import subprocess
 from util import get_resolved_path, get_last_changed_dir, save_pickle, parse_proc_stdout
-from miner import get_cc2vec_attributes, get_projectkb_commits, create_dextend_codes, get_projectkb_commits_top_1
+from miner import get_cc2vec_attributes, get_projectkb_commits, create_dextend_codes, get_projectkb_commits_top_1, \
+    save_cc2vec_pickle
 from config import get_config
+from dictionary import DictionaryBuilder, save_dictionary
+from cache import get_patch_memo
+from transport import get_transport
 from datetime import datetime
 
 CONFIG = get_config()
@@ -87,9 +91,7 @@ class CC2Vec:
 
 def get_local_cc2vec_instance() -> CC2Vec:
     return CC2Vec(root=Path("F:/work/kutatas/code_change_repr/compare_cgange_reprs/cc2vec"),
-                  dictionary_path=Path(
-                      "F:/work/kutatas/code_change_repr/compare_cgange_reprs/cc2vec/data/jit/openstack_dict"
-                      ".pkl"),
+                  dictionary_path=Path(CONFIG.dictionary_path),
                   raw_train=Path(CONFIG.data_train_path),
                   raw_test=Path(CONFIG.data_test_path),
                   dextend_train=Path(CONFIG.data_dextend_train_path),
@@ -104,7 +106,7 @@ def get_local_cc2vec_instance() -> CC2Vec:
 
 def save_input_data(selected_indicies, zipped_all_attributes, raw_save_path, dextend_save_path) -> None:
     attributes = tuple(zip(*[zipped_all_attributes[idx] for idx in selected_indicies]))
-    save_pickle(attributes, raw_save_path)
+    save_cc2vec_pickle(attributes, raw_save_path)
 
     dextend_codes = create_dextend_codes(attributes[3])
     save_pickle((attributes[0], attributes[1], attributes[2], dextend_codes),
@@ -114,7 +116,11 @@ def save_input_data(selected_indicies, zipped_all_attributes, raw_save_path, dex
 def crossvalidate_cc2vec():
     # get data for 10 fold:
     f1_scores = []
-    cc2vec_attributes = get_cc2vec_attributes(get_projectkb_commits_top_1())
+    dictionary_builder = DictionaryBuilder()
+    cc2vec_attributes = get_cc2vec_attributes(get_projectkb_commits_top_1(), dictionary_builder)
+    print(get_patch_memo().get_report())
+    save_dictionary(dictionary_builder.get_counts(), Path(CONFIG.dictionary_path), CONFIG.dictionary_min_freq,
+                    CONFIG.dictionary_max_size)
     zipped_cc2vec_attributes = list(zip(*cc2vec_attributes))
     kf = model_selection.KFold(n_splits=N_FOLD, shuffle=True)
     for train, test in kf.split(zipped_cc2vec_attributes):
@@ -134,3 +140,7 @@ def crossvalidate_cc2vec():
 
 if __name__ == "__main__":
     crossvalidate_cc2vec()
+
+    transport_report = get_transport().get_report()
+    if transport_report:
+        print(transport_report)
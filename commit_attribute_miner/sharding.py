@@ -0,0 +1,140 @@
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+def get_shard_index(repo: str, sha: str, count: int) -> int:
+    """
+    Get the shard of a commit, the hash is stable across processes and machines (unlike the builtin hash)
+    :param repo: The repository of the commit
+    :param sha: The sha of the commit
+    :param count: The number of shards
+    :return: The index of the shard the commit belongs to
+    """
+    digest = sha256(f"{repo}@{sha}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, str_: str) -> "Shard":
+        """
+        Parse a shard given in the form of i/N, where i is the 0 based index of the shard and N is the number of shards
+        """
+        try:
+            index, count = (int(part) for part in str_.split("/"))
+        except ValueError:
+            raise ArgumentTypeError(f"Shard should be given as i/N, got {str_}")
+        if count < 1:
+            raise ArgumentTypeError(f"The number of shards should be at least 1, got {count}")
+        if not 0 <= index < count:
+            raise ArgumentTypeError(f"Shard index should be between 0 and {count - 1}, got {index}")
+
+        return cls(index, count)
+
+    def contains(self, repo: str, sha: str) -> bool:
+        return get_shard_index(repo, sha, self.count) == self.index
+
+    def select(self, commits: list[T]) -> tuple[list[int], list[T]]:
+        """
+        Select the commits of the shard
+        :param commits: The whole work list, each element should have a repo and a sha attribute
+        :return: tuple[positions of the selected commits in the work list, selected commits]
+        """
+        selected = [(pos, commit) for pos, commit in enumerate(commits) if self.contains(commit.repo, commit.sha)]
+        return [pos for pos, _ in selected], [commit for _, commit in selected]
+
+    def get_path(self, path_: str | Path) -> Path:
+        """
+        Get the shard specific version of an output path
+        :param path_: The output path of a single-node run
+        :return: The output path of this shard
+        """
+        path_ = Path(path_)
+        return path_.with_name(f"{path_.stem}.shard_{self.index}_of_{self.count}{path_.suffix}")
+
+
+def parse_shard_count(str_: str) -> int:
+    try:
+        count = int(str_)
+    except ValueError:
+        raise ArgumentTypeError(f"The number of shards should be an integer, got {str_}")
+    if count < 1:
+        raise ArgumentTypeError(f"The number of shards should be at least 1, got {count}")
+
+    return count
+
+
+def get_all_shards(count: int) -> list[Shard]:
+    return [Shard(index, count) for index in range(count)]
+
+
+def get_kept_positions(positions: list[int], commits: Iterable, kept_shas: list[str]) -> list[int]:
+    """
+    Get the positions of the commits that produced an output, when some of the commits are skipped
+    :param positions: The positions of the commits in the work list
+    :param commits: The commits in the same order as their positions
+    :param kept_shas: The shas of the commits that were not skipped, in their original order
+    :return: The positions of the kept commits
+    """
+    kept_positions = []
+    kept_idx = 0
+    for pos, commit in zip(positions, commits):
+        if kept_idx < len(kept_shas) and commit.sha == kept_shas[kept_idx]:
+            kept_positions.append(pos)
+            kept_idx += 1
+
+    return kept_positions
+
+
+def merge_csv_shards(count: int, result_file: Path, get_position: Callable[[str], int]) -> None:
+    """
+    Merge the csv files of the shards into the csv file a single-node run would produce. Shards without a csv file
+    (e.g. none of their commits produced a row) are skipped.
+    :param count: The number of shards
+    :param result_file: The csv file of a single-node run
+    :param get_position: Gets the position of the commit of a row in the work list, the rows are ordered by it
+    :return: None
+    """
+    header = None
+    rows = []
+    for shard in get_all_shards(count):
+        shard_result_file = shard.get_path(result_file)
+        if not shard_result_file.exists():
+            continue
+        with shard_result_file.open() as fp:
+            header = fp.readline()
+            rows.extend(fp.readlines())
+
+    if header is None:
+        return
+
+    # the sort is stable, so the rows of a commit keep their order
+    rows.sort(key=get_position)
+    with Path(result_file).open("w") as fp:
+        fp.write(header)
+        fp.writelines(rows)
+
+
+def parse_shard_args(description: str) -> Namespace:
+    """
+    Parse the sharding arguments shared by the runnable modules
+    :param description: The description of the module
+    :return: Namespace with shard (Shard or None) and merge (number of shards to merge or None)
+    """
+    parser = ArgumentParser(description=description)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--shard", type=Shard.parse, default=None,
+                       help="only process the i-th of N disjoint slices of the commits, given as i/N (0 <= i < N)")
+    group.add_argument("--merge", type=parse_shard_count, default=None, metavar="N",
+                       help="combine the outputs of the N shards into the output of a single-node run")
+
+    return parser.parse_args()
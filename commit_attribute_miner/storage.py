@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+import logging
+import os
+import pickle
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s]| %(message)s", datefmt="%m-%d %H:%M:%S")
+
+# a lock file older than this (in seconds) is considered to be left behind by a killed process
+STALE_LOCK_SECONDS = 10 * 60
+
+# the lock files held by the current thread
+HELD_LOCKS = threading.local()
+
+
+def atomic_write_bytes(path: Path, content: bytes) -> None:
+    """
+    Write the content to a temporary file next to the path, then rename it, so readers never see a partially
+    written file, even if the process is killed
+    :param path: The path of the file
+    :param content: The content of the file
+    :return: None
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def atomic_save_pickle(data: Any, save_path: Path) -> None:
+    atomic_write_bytes(save_path, pickle.dumps(data))
+
+
+def touch(path: Path) -> None:
+    """
+    Set the modification time of the file to now, used to mark cache entries as recently used
+    :param path: The path of the file
+    :return: None
+    """
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def load_cached_pickle(load_path: Path) -> Any | None:
+    """
+    Load a pickle that may be missing or corrupted, corrupted pickles are removed so they are fetched again
+    :param load_path: The path of the pickle
+    :return: The unpickled object, or None if the pickle is missing or corrupted
+    """
+    try:
+        with load_path.open("rb") as fp:
+            return pickle.load(fp)
+    except FileNotFoundError:
+        return None
+    except (EOFError, pickle.UnpicklingError, ValueError, IndexError, KeyError) as ex:
+        logging.error(f"Corrupted cache entry {load_path}, removing it: {ex!r}")
+        load_path.unlink(missing_ok=True)
+        return None
+
+
+def holds_file_lock() -> bool:
+    """
+    :return: True if the current thread holds a lock acquired by file_lock
+    """
+    return bool(getattr(HELD_LOCKS, "paths", None))
+
+
+def read_lock_token(lock_path: Path) -> str | None:
+    try:
+        return lock_path.read_text()
+    except FileNotFoundError:
+        return None
+
+
+def claim_stale_lock(lock_path: Path, token: str) -> None:
+    """
+    Remove a lock left behind by a killed process. The lock is first renamed to a unique name, so only one of the
+    waiting processes claims it, and it is put back if it turns out to be refreshed in the meantime.
+    :param lock_path: The path of the stale lock file
+    :param token: The unique token of the claiming process
+    :return: None
+    """
+    claimed_path = lock_path.with_name(f"{lock_path.name}.{token}.stale")
+    try:
+        os.replace(lock_path, claimed_path)
+    except FileNotFoundError:
+        return
+
+    try:
+        if time.time() - claimed_path.stat().st_mtime <= STALE_LOCK_SECONDS:
+            # the owner refreshed it or a new lock was created after the age check, give it back
+            try:
+                os.link(claimed_path, lock_path)
+            except FileExistsError:
+                pass
+        else:
+            logging.error(f"Removed stale lock {lock_path}")
+    finally:
+        claimed_path.unlink(missing_ok=True)
+
+
+def refresh_lock(lock_path: Path, token: str, stop: threading.Event) -> None:
+    """
+    Keep the modification time of a held lock recent, so long fetches are not mistaken for killed processes
+    """
+    while not stop.wait(STALE_LOCK_SECONDS / 4):
+        if read_lock_token(lock_path) == token:
+            touch(lock_path)
+
+
+@contextmanager
+def file_lock(lock_path: Path, poll_seconds: float = 0.2) -> Iterator[None]:
+    """
+    Inter-process lock based on exclusively creating the lock file, works on every platform and on shared disks. The
+    lock file holds a unique token of its owner, so a process never removes a lock that was taken over by another one.
+    :param lock_path: The path of the lock file
+    :param poll_seconds: The time to wait between two attempts to acquire the lock
+    :return: None
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    token = f"{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex}"
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime > STALE_LOCK_SECONDS:
+                    claim_stale_lock(lock_path, token)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll_seconds)
+
+    with os.fdopen(fd, "w") as fp:
+        fp.write(token)
+
+    stop = threading.Event()
+    refresher = threading.Thread(target=refresh_lock, args=(lock_path, token, stop), daemon=True)
+    refresher.start()
+    if getattr(HELD_LOCKS, "paths", None) is None:
+        HELD_LOCKS.paths = []
+    HELD_LOCKS.paths.append(lock_path)
+    try:
+        yield
+    finally:
+        HELD_LOCKS.paths.remove(lock_path)
+        stop.set()
+        refresher.join()
+        if read_lock_token(lock_path) == token:
+            lock_path.unlink(missing_ok=True)
+        else:
+            logging.error(f"Lock {lock_path} was taken over by another process")
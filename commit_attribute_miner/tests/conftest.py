@@ -0,0 +1,5 @@
+from pathlib import Path
+import sys
+
+# the modules import each other by their plain names, as they do when run from the commit_attribute_miner directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
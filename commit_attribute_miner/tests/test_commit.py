@@ -0,0 +1,38 @@
+from commit import GHCommit
+from config import get_config
+
+
+class UnreachableCache:
+    """
+    A cache that can not retrieve anything, e.g. because the retries ran out or the replay archive misses the commit
+    """
+    def get_commit_files(self, repo: str, commit_hash: str, file_types: list[str], max_files: int) -> None:
+        return None
+
+    def get_commit(self, repo: str, commit_hash: str) -> None:
+        return None
+
+
+def get_unreachable_commit(sha: str) -> GHCommit:
+    commit = GHCommit.__new__(GHCommit)
+    commit.repo, commit.sha, commit.label = "owner/repo", sha, "1"
+    commit.cache = UnreachableCache()
+    commit.config = get_config()
+    return commit
+
+
+def test_failed_load_keeps_exported_files(tmp_path):
+    commit_dir = tmp_path / "owner_repo_abc"
+    commit_dir.mkdir()
+    (commit_dir / "pre_A.java").write_bytes(b"class A {}")
+    (commit_dir / "post_A.java").write_bytes(b"class A { int a; }")
+
+    get_unreachable_commit("abc").save_pre_post_files_pairs(tmp_path)
+
+    assert sorted(path.name for path in commit_dir.iterdir()) == ["post_A.java", "pre_A.java"]
+
+
+def test_failed_load_writes_nothing(tmp_path):
+    get_unreachable_commit("def").save_pre_post_files_pairs(tmp_path)
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,63 @@
+from commit2vec_store import Commit2VecStore
+
+PAIRS = [("src/a/A.java", b"class A {}", "src/a/A.java", b"class A { int a; }"),
+         ("src/b/A.java", b"class A {}", "src/b/A.java", b"class A { int b; }")]
+
+
+def get_blob_count(store: Commit2VecStore) -> int:
+    return sum(1 for path in (store.root_path / "blobs").rglob("*") if path.is_file())
+
+
+def test_same_content_is_saved_once(tmp_path):
+    store = Commit2VecStore(tmp_path)
+    store.save_commit_pairs("owner/repo", "abc", PAIRS)
+    store.save_commit_pairs("owner/repo", "def", PAIRS[:1])
+
+    # the two pre states are the same content
+    assert get_blob_count(store) == 3
+    assert store.get_commit_pairs("owner/repo", "abc") == PAIRS
+
+
+def test_reload(tmp_path):
+    store = Commit2VecStore(tmp_path)
+    store.save_commit_pairs("owner/repo", "abc", PAIRS)
+    store.save_commit_pairs("owner/repo", "def", [])
+
+    reloaded = Commit2VecStore(tmp_path)
+
+    assert reloaded.is_exported("owner/repo", "abc") and reloaded.has_pairs("owner/repo", "abc")
+    assert reloaded.is_exported("owner/repo", "def") and not reloaded.has_pairs("owner/repo", "def")
+    assert not reloaded.is_exported("owner/repo", "ghi")
+    assert reloaded.get_commit_pairs("owner/repo", "abc") == PAIRS
+
+
+def test_partially_written_record_is_skipped(tmp_path):
+    store = Commit2VecStore(tmp_path)
+    store.save_commit_pairs("owner/repo", "abc", PAIRS)
+    with store.get_manifest_path().open("a") as fp:
+        # the process was killed while appending the record
+        fp.write('{"repo": "owner/repo", "sha": "def", "pa')
+
+    reloaded = Commit2VecStore(tmp_path)
+    assert reloaded.is_exported("owner/repo", "abc")
+    assert not reloaded.is_exported("owner/repo", "def")
+
+    reloaded.save_commit_pairs("owner/repo", "def", PAIRS[1:])
+    assert Commit2VecStore(tmp_path).get_commit_pairs("owner/repo", "def") == PAIRS[1:]
+
+
+def test_merge(tmp_path):
+    store = Commit2VecStore(tmp_path / "merged")
+    store.save_commit_pairs("owner/repo", "abc", PAIRS[:1])
+    other = Commit2VecStore(tmp_path / "shard")
+    other.save_commit_pairs("owner/repo", "abc", PAIRS[:1])
+    other.save_commit_pairs("owner/repo", "def", PAIRS)
+
+    store.merge(other)
+
+    assert store.get_commit_pairs("owner/repo", "abc") == PAIRS[:1]
+    assert store.get_commit_pairs("owner/repo", "def") == PAIRS
+    assert get_blob_count(store) == 3
+    # already exported commits are not recorded again
+    assert len(store.get_manifest_path().read_text().splitlines()) == 2
+    assert Commit2VecStore(tmp_path / "merged").get_commit_pairs("owner/repo", "def") == PAIRS
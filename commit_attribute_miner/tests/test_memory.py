@@ -0,0 +1,78 @@
+"""
+Compares the memory used for mining and saving the cc2vec codes in the compact token representation with keeping the
+codes as nested lists of line strings (the representation before the vocabulary was introduced). Also runnable as a
+script, e.g. `python tests/test_memory.py compact 800`, which prints the peak RSS of the process.
+"""
+from pathlib import Path
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import miner
+from util import save_pickle
+from vocabulary import FileTokens
+
+N_FILES = 5
+N_LINES = 80
+
+
+def get_lines(commit_idx: int, file_idx: int, kind: str) -> list[str]:
+    return [f"{kind} int var{(commit_idx * 7 + idx) % 997} = call_{(file_idx * 13 + idx) % 211} ( arg{idx % 17} ) ;"
+            for idx in range(N_LINES)]
+
+
+def get_attributes(n_commits: int, make_file) -> tuple[list[str], list[int], list[str], list]:
+    ids, labels, messages, codes = [], [], [], []
+    for commit_idx in range(n_commits):
+        ids.append(f"{commit_idx:040x}")
+        labels.append(commit_idx % 2)
+        messages.append(f"fix bug {commit_idx}")
+        codes.append([make_file(get_lines(commit_idx, file_idx, "a"), get_lines(commit_idx, file_idx, "r"))
+                      for file_idx in range(N_FILES)])
+    return ids, labels, messages, codes
+
+
+def save_nested(n_commits: int, save_path: Path) -> None:
+    attributes = get_attributes(n_commits, lambda added, removed: {"added_code": added, "removed_code": removed})
+    save_pickle(attributes, save_path)
+
+
+def save_compact(n_commits: int, save_path: Path) -> None:
+    miner.save_cc2vec_pickle(get_attributes(n_commits, FileTokens), save_path)
+
+
+def get_peak_rss_mib(mode: str, n_commits: int, save_path: Path) -> float:
+    # every measurement runs in a fresh process, as the peak RSS of a process never decreases
+    result = subprocess.run([sys.executable, __file__, mode, str(n_commits), str(save_path)],
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+def test_compact_pickle_equals_nested_pickle(tmp_path):
+    save_nested(20, tmp_path / "nested.pkl")
+    save_compact(20, tmp_path / "compact.pkl")
+
+    with (tmp_path / "nested.pkl").open("rb") as nested_fp, (tmp_path / "compact.pkl").open("rb") as compact_fp:
+        assert pickle.load(compact_fp) == pickle.load(nested_fp)
+
+
+def test_compact_codes_lower_peak_rss(tmp_path):
+    # the peak RSS is read with the resource module, which is not available on Windows
+    pytest.importorskip("resource")
+    nested_rss = get_peak_rss_mib("nested", 400, tmp_path / "nested.pkl")
+    compact_rss = get_peak_rss_mib("compact", 400, tmp_path / "compact.pkl")
+
+    assert compact_rss < nested_rss
+
+
+if __name__ == "__main__":
+    mode, n_commits, save_path = sys.argv[1], int(sys.argv[2]), Path(sys.argv[3] if len(sys.argv) > 3 else "codes.pkl")
+    (save_compact if mode == "compact" else save_nested)(n_commits, save_path)
+    import resource
+
+    # ru_maxrss is in KiB on Linux
+    print(f"peak RSS MiB: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}")
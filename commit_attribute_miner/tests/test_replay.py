@@ -0,0 +1,84 @@
+from github import Github
+from github.Commit import Commit
+from github.Requester import Requester
+import pytest
+
+from cache import Cache
+from storage import atomic_save_pickle
+from config import get_config
+from transport import ReplayArchive, ReplayMissError, Transport, install_archive
+
+REPO = "owner/repo"
+SHA = "a" * 40
+API_URL = f"https://api.github.com/repos/{REPO}"
+
+
+def get_raw_file(filename: str) -> dict:
+    return {"filename": filename, "status": "modified", "patch": "@@ -1 +1 @@\n-a\n+b",
+            "raw_url": f"https://github.com/{REPO}/raw/{SHA}/{filename}"}
+
+
+def serve_from_network(requester, verb, url, parameters=None, headers=None, input=None):
+    if url in (API_URL, f"/repos/{REPO}"):
+        return {}, {"url": API_URL, "full_name": REPO, "name": "repo"}
+    if url == f"{API_URL}/commits/{SHA}":
+        files = [get_raw_file(filename) for filename in ("A.java", "B.java", "c.py", "d.py")]
+        return {}, {"url": url, "sha": SHA, "parents": [], "commit": {"message": "Fix bug"}, "files": files}
+    raise AssertionError(f"Unexpected request {url} {parameters}")
+
+
+def fail_without_network(requester, verb, url=None, parameters=None, headers=None, input=None):
+    raise AssertionError(f"Network access while replaying {url} {parameters}")
+
+
+def get_filenames(files) -> list[str]:
+    return [file.filename for file in files]
+
+
+def test_replay_after_filter_change(tmp_path, monkeypatch):
+    archive_path = tmp_path / "archive"
+
+    monkeypatch.setattr(Requester, "requestJsonAndCheck", serve_from_network)
+    install_archive(ReplayArchive(archive_path, replay=False))
+    recorded = Cache(Github(), tmp_path / "cache").get_commit_files(REPO, SHA, [".java"], 10)
+    assert get_filenames(recorded) == ["A.java", "B.java"]
+
+    # the changed filter invalidates the cached files, so they are requested again from the stripped commit
+    monkeypatch.setattr(Requester, "requestJsonAndCheck", fail_without_network)
+    archive = ReplayArchive(archive_path, replay=True)
+    install_archive(archive)
+    replayed = Cache(Github(), tmp_path / "cache").get_commit_files(REPO, SHA, [".py"], 1)
+
+    assert get_filenames(replayed) == ["c.py"]
+    assert archive.misses == []
+
+
+def test_replay_miss_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(Requester, "requestJsonAndCheck", fail_without_network)
+    archive = ReplayArchive(tmp_path / "archive", replay=True)
+    install_archive(archive)
+
+    with pytest.raises(ReplayMissError):
+        Github().get_repo(REPO)
+    assert len(archive.misses) == 1
+
+
+def test_files_of_commit_cached_with_files_are_not_requested(tmp_path, monkeypatch):
+    # commits cached before the files were stripped still hold the first page of their files
+    _, raw_commit = serve_from_network(None, "GET", f"{API_URL}/commits/{SHA}")
+    cache = Cache(Github(), tmp_path / "cache")
+    repo_path, _ = cache.get_cached_repo_path(REPO)
+    atomic_save_pickle(Commit(Github()._Github__requester, {}, raw_commit, completed=True), repo_path / f"{SHA}.pkl")
+
+    monkeypatch.setattr(Requester, "requestJsonAndCheck", fail_without_network)
+
+    assert get_filenames(cache.get_commit_files(REPO, SHA, [".py"], 10)) == ["c.py", "d.py"]
+
+
+def test_missing_url_with_space_is_remembered(tmp_path, monkeypatch):
+    monkeypatch.setattr(Transport, "download", fail_without_network)
+    config = get_config().copy(update={"cache_path": str(tmp_path)})
+    url_ = f"https://github.com/{REPO}/raw/{SHA}/src/My File.java"
+    Transport(config).add_missing_url(url_)
+
+    assert Transport(config).get_content(url_) is None
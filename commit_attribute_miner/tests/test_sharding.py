@@ -0,0 +1,118 @@
+from argparse import ArgumentTypeError
+from dataclasses import dataclass, field
+
+import pytest
+
+import miner
+from commit import CommitAttributes
+from dictionary import DictionaryBuilder, build_dictionary
+import get_files_for_commit2vec
+from config import get_config
+from sharding import Shard, get_all_shards, merge_csv_shards
+from vocabulary import FileTokens, Vocabulary, to_cc2vec_codes
+
+N_SHARDS = 3
+
+
+@dataclass
+class FakeAttributes:
+    hash: str
+    files: list[tuple[list[str], list[str]]]
+    message: str
+
+    def get_files_tokens(self) -> list[FileTokens]:
+        # the vocabulary of the "process" mining the commit
+        return [FileTokens(added, removed, miner.VOCABULARY) for added, removed in self.files]
+
+
+@dataclass
+class FakeCommit:
+    repo: str
+    sha: str
+    label: str
+    files: list[tuple[list[str], list[str]]] = field(default_factory=list)
+    retrievable: bool = True
+
+    def get_attributes(self) -> CommitAttributes | None:
+        if not self.retrievable:
+            return None
+        return FakeAttributes(self.sha, self.files, f"Fix  Bug in {self.repo}\n{self.sha}")
+
+
+def get_commits() -> list[FakeCommit]:
+    commits = []
+    for idx in range(24):
+        files = [([f"int Var{idx % 5} = {idx} ;", "return Var ;"], [f"int var{idx % 3} = 0 ;"])] if idx % 7 else []
+        commits.append(FakeCommit(f"owner/repo{idx % 4}", f"{idx:040x}", str(idx % 2), files, retrievable=idx != 10))
+    return commits
+
+
+def mine_single_run(commits: list[FakeCommit]) -> tuple:
+    builder = DictionaryBuilder(n_workers=1)
+    ids, labels, messages, codes = miner.get_cc2vec_attributes(commits, builder)
+    return (ids, labels, messages, to_cc2vec_codes(codes, miner.VOCABULARY)), \
+        build_dictionary(builder.get_counts(), vocabulary=miner.VOCABULARY)
+
+
+def test_cc2vec_merge_equals_single_run(tmp_path, monkeypatch):
+    commits = get_commits()
+    monkeypatch.setattr(miner.CONFIG, "data_path", str(tmp_path / "data.pkl"))
+
+    monkeypatch.setattr(miner, "VOCABULARY", Vocabulary())
+    expected = mine_single_run(commits)
+
+    for shard in get_all_shards(N_SHARDS):
+        # every shard runs in its own process, so the same token gets a different id in each of them
+        vocabulary = Vocabulary()
+        for idx in range(shard.index * 7):
+            vocabulary.get_id(f"other_token_{idx}")
+        monkeypatch.setattr(miner, "VOCABULARY", vocabulary)
+        miner.save_cc2vec_shard(shard, commits)
+
+    monkeypatch.setattr(miner, "VOCABULARY", Vocabulary())
+    (ids, labels, messages, codes), counts = miner.merge_cc2vec_shards(N_SHARDS)
+    merged = (ids, labels, messages, to_cc2vec_codes(codes, miner.VOCABULARY)), \
+        build_dictionary(counts, vocabulary=miner.VOCABULARY)
+
+    assert merged == expected
+    # the commits without files and the one that could not be retrieved are left out
+    assert expected[0][0] == [commit.sha for idx, commit in enumerate(commits) if idx % 7 and idx != 10]
+
+
+def test_csv_merge_equals_single_run(tmp_path):
+    commits = get_commits()
+    commit_positions = {(commit.repo, commit.sha): pos for pos, commit in enumerate(commits)}
+    header = "repo,method,sha\n"
+    rows = [f"{commit.repo},method_{idx},{commit.sha}\n" for commit in commits for idx in range(2)]
+    result_file = tmp_path / "method_pairs.csv"
+
+    for shard in get_all_shards(N_SHARDS):
+        shard_rows = [row for row in rows if shard.contains(row.split(",")[0], row.rstrip("\n").split(",")[-1])]
+        with shard.get_path(result_file).open("w") as fp:
+            fp.write(header)
+            fp.writelines(shard_rows)
+
+    merge_csv_shards(N_SHARDS, result_file,
+                     lambda row: commit_positions[(row.split(",")[0], row.rstrip("\n").split(",")[-1])])
+
+    assert result_file.read_text() == header + "".join(rows)
+
+
+def test_commit2vec_directory_merge_skips_missing_shard(tmp_path, monkeypatch):
+    config = get_config().copy(update={"commit2vec_export_mode": "directory"})
+    monkeypatch.setattr(get_files_for_commit2vec, "get_config", lambda: config)
+    root = tmp_path / "commit2vec"
+    for shard in get_all_shards(N_SHARDS)[1:]:
+        commit_dir = shard.get_path(root) / f"owner_repo_{shard.index}"
+        commit_dir.mkdir(parents=True)
+        (commit_dir / "pre_A.java").write_bytes(b"class A {}")
+
+    get_files_for_commit2vec.merge_commit2vec_shards(N_SHARDS, root)
+
+    assert sorted(path.name for path in root.iterdir()) == ["owner_repo_1", "owner_repo_2"]
+
+
+@pytest.mark.parametrize("shard_str", ["0/0", "1/1", "-1/2", "a/2"])
+def test_invalid_shards_are_rejected(shard_str):
+    with pytest.raises(ArgumentTypeError):
+        Shard.parse(shard_str)
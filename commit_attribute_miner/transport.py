@@ -0,0 +1,323 @@
+from dataclasses import dataclass, field
+from functools import cache
+from hashlib import sha256
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+import json
+import logging
+import random
+import time
+
+import requests
+from github.GithubException import GithubException, RateLimitExceededException, UnknownObjectException
+from github.Requester import Requester
+
+from config import Config, get_config
+from storage import atomic_save_pickle, load_cached_pickle
+
+logging.basicConfig(format="%(asctime)s [%(levelname)s]| %(message)s", datefmt="%m-%d %H:%M:%S")
+
+# responses worth retrying, every other non-200 response is final
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# responses meaning the content does not exist, these are remembered so they are not requested again
+MISSING_STATUS_CODES = {404, 410}
+MAX_BACKOFF_SECONDS = 60
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+T = TypeVar("T")
+
+
+class TransientError(Exception):
+    """
+    A request failed with an error that is expected to be temporary, e.g. a 502 response or a timeout
+    """
+    pass
+
+
+class ReplayMissError(TransientError):
+    """
+    The response of a request is not in the replay archive. Handled like a transient failure, so the missing response
+    is not mistaken for missing content, but it is never retried.
+    """
+    pass
+
+
+# failures of a request that may succeed when it is retried
+TRANSIENT_REQUEST_EXCEPTIONS = (TransientError, requests.ConnectionError, requests.Timeout,
+                                requests.exceptions.ChunkedEncodingError)
+
+
+def is_transient_request_error(ex: Exception) -> bool:
+    return isinstance(ex, TRANSIENT_REQUEST_EXCEPTIONS) and not isinstance(ex, ReplayMissError)
+
+
+def is_transient_github_error(ex: Exception) -> bool:
+    if isinstance(ex, RateLimitExceededException):
+        # handled by waiting for the rate limit to reset
+        return False
+    if isinstance(ex, GithubException):
+        return ex.status in TRANSIENT_STATUS_CODES
+    return is_transient_request_error(ex)
+
+
+def retry_with_backoff(func: Callable[[], T], is_transient: Callable[[Exception], bool], max_retries: int,
+                       base_delay: float = 1.0) -> T:
+    """
+    Call func, retrying it with exponential backoff and full jitter as long as it fails with transient errors
+    :param func: The function to call
+    :param is_transient: Decides if an exception raised by func is worth retrying
+    :param max_retries: The maximum number of retries, the last transient error is raised when it is reached
+    :param base_delay: The maximum delay (in seconds) before the first retry, doubled for every further retry
+    :return: The return value of func
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception as ex:
+            if attempt == max_retries or not is_transient(ex):
+                raise
+
+            delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, base_delay * 2 ** attempt))
+            logging.error(f"Transient error: {ex!r}, retrying in {delay:.1f} s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+def read_capped(resp: requests.Response, max_bytes: int) -> bytes | None:
+    """
+    Read the body of a streamed response, but stop once it is larger than max_bytes
+    :param resp: The streamed response
+    :param max_bytes: The maximum accepted size of the content
+    :return: The content, or None if it is larger than max_bytes
+    """
+    # the header holds the size of the possibly compressed body, if even that is over the limit, do not download it
+    content_length = resp.headers.get("Content-Length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+        return None
+
+    content = bytearray()
+    for chunk in resp.iter_content(DOWNLOAD_CHUNK_BYTES):
+        content.extend(chunk)
+        if len(content) > max_bytes:
+            return None
+
+    return bytes(content)
+
+
+@dataclass
+class RecordedMissing:
+    """
+    Recorded in place of API responses that were 404
+    """
+    data: dict | None
+    headers: dict | None
+
+
+@dataclass
+class ReplayArchive:
+    """
+    Archive of GitHub API responses and raw downloads, filled in record mode and read in replay mode
+    """
+    root_path: Path
+    replay: bool
+    hits: int = 0
+    misses: list[str] = field(default_factory=list)
+
+    def get_entry_path(self, kind: str, key: str) -> Path:
+        key_hash = sha256(key.encode()).hexdigest()
+        return Path(self.root_path) / kind / key_hash[:2] / f"{key_hash}.pkl"
+
+    def save(self, kind: str, key: str, response: Any) -> None:
+        atomic_save_pickle(response, self.get_entry_path(kind, key))
+
+    def load(self, kind: str, key: str) -> Any:
+        """
+        :raises ReplayMissError: If the response was not recorded
+        """
+        response = load_cached_pickle(self.get_entry_path(kind, key))
+        if response is None:
+            self.misses.append(key)
+            raise ReplayMissError(f"No recorded response for {key}")
+
+        self.hits += 1
+        return response
+
+    def get_report(self) -> str:
+        report = f"Replay archive: {self.hits} hits, {len(self.misses)} misses"
+        return "\n".join([report] + [f"  missing: {key}" for key in self.misses])
+
+
+def get_request_key(verb: str, url: str, parameters: dict | None, input: Any) -> str:
+    """
+    Get the archive key of an API request. Requests returning the same response get the same key: missing and empty
+    parameters are the same, and so is requesting the first page explicitly or not (e.g. Repository.get_commit passes
+    no parameters, while paginating the files of the same commit passes {}).
+    :return: The key of the request
+    """
+    parameters = {name: value for name, value in (parameters or {}).items()
+                  if not (name == "page" and str(value) == "1")}
+    return json.dumps([verb, url, parameters or None, input], sort_keys=True, default=str)
+
+
+def install_archive(archive: ReplayArchive) -> None:
+    """
+    Route every GitHub API request through the archive. The requester class is patched, because the objects loaded from
+    the cache carry their own requester instances.
+    :param archive: The archive to record into or replay from
+    :return: None
+    """
+    request_json_and_check = Requester.requestJsonAndCheck
+
+    def archived_request_json_and_check(requester, verb, url, parameters=None, headers=None, input=None):
+        key = get_request_key(verb, url, parameters, input)
+        if archive.replay:
+            response = archive.load("api", key)
+            if isinstance(response, RecordedMissing):
+                raise UnknownObjectException(404, response.data, response.headers)
+            return response
+
+        try:
+            response = request_json_and_check(requester, verb, url, parameters, headers, input)
+        except UnknownObjectException as ex:
+            archive.save("api", key, RecordedMissing(ex.data, ex.headers))
+            raise
+        archive.save("api", key, response)
+        return response
+
+    Requester.requestJsonAndCheck = archived_request_json_and_check
+
+
+@dataclass
+class Transport:
+    """
+    Retrying access to GitHub and raw file contents
+    """
+    config: Config = field(default_factory=get_config)
+    session: requests.Session = field(init=False, default_factory=requests.Session)
+    missing_urls: set[str] = field(init=False, default=None)
+    archive: ReplayArchive | None = field(init=False, default=None)
+    size_skips: int = field(init=False, default=0)
+
+    def __post_init__(self):
+        if self.config.github_access_mode != "live":
+            self.archive = ReplayArchive(Path(self.config.replay_archive_path),
+                                         self.config.github_access_mode == "replay")
+            install_archive(self.archive)
+
+    def get_size_skips_path(self) -> Path:
+        return Path(self.config.cache_path) / "skipped_for_size.txt"
+
+    def record_size_skip(self, url_: str, reason: str) -> None:
+        """
+        Record that the content of the url was not downloaded because it is too large
+        :param url_: The url of the skipped content
+        :param reason: The limit the content exceeded
+        :return: None
+        """
+        logging.error(f"Skipping {url_}: {reason}")
+        self.size_skips += 1
+        size_skips_path = self.get_size_skips_path()
+        size_skips_path.parent.mkdir(parents=True, exist_ok=True)
+        with size_skips_path.open("a") as fp:
+            fp.write(f"{url_}\t{reason}\n")
+
+    def get_missing_urls_path(self) -> Path:
+        return Path(self.config.cache_path) / "missing_urls.txt"
+
+    def load_missing_urls(self) -> set[str]:
+        if self.missing_urls is None:
+            missing_urls_path = self.get_missing_urls_path()
+            self.missing_urls = set(missing_urls_path.read_text().splitlines()) if missing_urls_path.exists() else set()
+
+        return self.missing_urls
+
+    def add_missing_url(self, url_: str) -> None:
+        """
+        Remember that the url does not exist, raw urls contain the commit hash, so their content never changes
+        :param url_: The url that responded with a missing status
+        :return: None
+        """
+        self.load_missing_urls().add(url_)
+        missing_urls_path = self.get_missing_urls_path()
+        missing_urls_path.parent.mkdir(parents=True, exist_ok=True)
+        with missing_urls_path.open("a") as fp:
+            fp.write(f"{url_}\n")
+
+    def retry(self, func: Callable[[], T], is_transient: Callable[[Exception], bool] = is_transient_github_error) -> T:
+        return retry_with_backoff(func, is_transient, self.config.download_max_retries)
+
+    def get_content(self, url_: str) -> bytes | None:
+        """
+        Download the content of the url, retrying transient failures. Contents larger than max_file_bytes are skipped.
+        :param url_: The url of the content
+        :return: The content, or None if it does not exist or it is too large
+        :raises TransientError: If the content could not be downloaded even after retrying
+        """
+        if url_ in self.load_missing_urls():
+            return None
+
+        if self.archive is not None and self.archive.replay:
+            status_code, content = self.archive.load("raw", url_)
+        else:
+            status_code, content = self.download(url_)
+            if self.archive is not None:
+                self.archive.save("raw", url_, (status_code, content))
+
+        if status_code == 200 and content is not None and len(content) > self.config.max_file_bytes:
+            # replayed (or recorded with a higher limit), so the limit was not applied while downloading
+            content = None
+        if status_code == 200 and content is None:
+            self.record_size_skip(url_, f"larger than {self.config.max_file_bytes} bytes")
+            return None
+        if status_code == 200:
+            return content
+        if status_code in MISSING_STATUS_CODES:
+            self.add_missing_url(url_)
+        else:
+            logging.error(f"Unexpected {status_code} response for {url_}")
+
+        return None
+
+    def download(self, url_: str) -> tuple[int, bytes | None]:
+        """
+        Download the content of the url from the network in chunks, retrying transient failures. The download is
+        aborted as soon as the content turns out to be larger than max_file_bytes.
+        :param url_: The url of the content
+        :return: tuple[status code, content], the content is None if it is too large
+        :raises TransientError: If the content could not be downloaded even after retrying
+        """
+        def download_once() -> tuple[int, bytes | None]:
+            with self.session.get(url_, timeout=self.config.download_timeout_seconds, stream=True) as resp:
+                if resp.status_code in TRANSIENT_STATUS_CODES:
+                    raise TransientError(f"{resp.status_code} response for {url_}")
+                if resp.status_code != 200:
+                    return resp.status_code, b""
+
+                return resp.status_code, read_capped(resp, self.config.max_file_bytes)
+
+        try:
+            return self.retry(download_once, is_transient_request_error)
+        except TRANSIENT_REQUEST_EXCEPTIONS as ex:
+            if isinstance(ex, TransientError):
+                raise
+            raise TransientError(f"Could not download {url_}: {ex!r}") from ex
+
+    def get_report(self) -> str | None:
+        """
+        :return: The hits and misses of the replay archive and the number of contents skipped for their size, None if
+        there is nothing to report
+        """
+        reports = []
+        if self.archive is not None:
+            reports.append(self.archive.get_report())
+        if self.size_skips:
+            reports.append(f"Skipped {self.size_skips} files for their size, see {self.get_size_skips_path()}")
+
+        return "\n".join(reports) if reports else None
+
+
+@cache
+def get_transport() -> Transport:
+    """
+    :return: The transport shared by the whole process, so its session and missing urls are reused by every request
+    """
+    return Transport()
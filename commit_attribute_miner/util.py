@@ -3,11 +3,17 @@ import pickle
 from github import Github
 from dotenv import load_dotenv
 from os import getenv
-from typing import Any
+from typing import Any, Iterable
 from pathlib import Path
-import requests
+
+from config import get_config
+from transport import get_transport
 
 GH_ACCESS_TOKEN_KEY = "GITHUB_ACCESS_TOKEN"
+DEXTEND_CODE = 'added _ code removed _ code'
+# must be increased whenever the output of prepare_cc2vec_input or get_lines_from_patch changes, so the memoized
+# results of the previous version are not reused
+TOKENIZER_VERSION = 1
 
 
 def read_file_as_bytes(file_path: str | Path, encode_str: str | None = None) -> bytes:
@@ -30,11 +36,13 @@ def save_commit2vec_file(path: Path, content: bytes | None):
 
 
 def get_file_content_from_url(url_: str) -> bytes | None:
-    resp = requests.get(url_)
-    if resp.status_code == 200:
-        return requests.get(url_).content
-
-    return None
+    """
+    Download the content of the url, transient failures are retried with backoff
+    :param url_: The url of the content
+    :return: The content, or None if it does not exist
+    :raises TransientError: If the content could not be downloaded even after retrying
+    """
+    return get_transport().get_content(url_)
 
 
 def parse_proc_stdout(str_: str) -> float:
@@ -49,12 +57,9 @@ def get_resolved_path(path_: Path) -> str:
     return str(path_.resolve())
 
 
-def create_dextend_codes(codes: str):
-    dextend_codes = []
-    for code in codes:
-        dextend_codes.append(['added _ code removed _ code'] * len(code))
-
-    return dextend_codes
+def create_dextend_codes(codes: list[list]) -> list[list[str]]:
+    # every entry refers to the same string object, only the number of files of the commit is needed from the codes
+    return [[DEXTEND_CODE] * len(code) for code in codes]
 
 
 def enclose_separators_with_spaces(str_: str) -> str:
@@ -78,13 +83,26 @@ def get_lines_from_patch(src: str, prefix: str) -> list[str]:
             and line.strip().removeprefix(prefix).strip() != ""]
 
 
+def tokenize_patch(patch: str) -> tuple[list[str], list[str]]:
+    """
+    Prepare the added and removed lines of a patch for cc2vec
+    :param patch: The patch of a file
+    :return: tuple[added_code, removed_code]
+    """
+    added_code = prepare_cc2vec_input(get_lines_from_patch(patch, "+"))
+    removed_code = prepare_cc2vec_input(get_lines_from_patch(patch, "-"))
+    return added_code, removed_code
+
+
 def get_github_access_token() -> str:
     load_dotenv()
     return getenv(GH_ACCESS_TOKEN_KEY)
 
 
 def get_github_instance() -> Github:
-    return Github(get_github_access_token())
+    # the transport routes the requests through the replay archive, when it is used
+    get_transport()
+    return Github(get_github_access_token(), timeout=get_config().download_timeout_seconds)
 
 
 def save_pickle(data: Any, save_path: Path) -> None:
@@ -94,3 +112,37 @@ def save_pickle(data: Any, save_path: Path) -> None:
     """
     with save_path.open("wb") as fp:
         pickle.dump(data, fp)
+
+
+class StreamedList:
+    """
+    Pickled as a list of the items of an iterable, the items are produced and written one by one instead of being held
+    in memory together. Should be pickled with save_streamed_pickle, and only once, as the iterable is consumed.
+    """
+    def __init__(self, items: Iterable):
+        self.items = items
+
+    def __reduce__(self):
+        # the items are appended to an empty list when unpickled, so the loaded object is a plain list
+        return list, (), None, iter(self.items)
+
+
+def save_streamed_pickle(data: Any, save_path: Path) -> None:
+    """
+    Pickle data that contains StreamedLists. The pickler does not memoize the written objects (which would keep every
+    streamed item alive until the end), so the data must not contain shared or recursive references that have to be
+    restored.
+    :param data: The data to pickle
+    :param save_path: The path of the pickle
+    :return: None
+    """
+    with save_path.open("wb") as fp:
+        pickler = pickle.Pickler(fp)
+        pickler.fast = True
+        pickler.dump(data)
+
+
+def load_pickle(load_path: Path) -> Any:
+    with load_path.open("rb") as fp:
+        return pickle.load(fp)
+
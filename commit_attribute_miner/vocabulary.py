@@ -0,0 +1,128 @@
+from array import array
+from typing import Iterable, Iterator
+
+# typecode of the arrays storing token ids and line boundaries (unsigned int, at least 4 bytes)
+ID_TYPECODE = "I"
+
+
+class Vocabulary:
+    """
+    Shared mapping between the tokens of the mined code and integer ids, so each distinct token is stored only once
+    """
+    __slots__ = ("token_ids", "tokens")
+
+    def __init__(self):
+        self.token_ids: dict[str, int] = {}
+        self.tokens: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def get_id(self, token: str) -> int:
+        """
+        Get the id of the token, the token is added to the vocabulary if it is not part of it yet
+        :param token: The token to look up
+        :return: The id of the token
+        """
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = len(self.tokens)
+            self.token_ids[token] = token_id
+            self.tokens.append(token)
+
+        return token_id
+
+    def get_id_map(self, tokens: list[str]) -> array:
+        """
+        Add the tokens of another vocabulary to this one
+        :param tokens: The tokens of the other vocabulary, ordered by their ids
+        :return: Array mapping the ids of the other vocabulary to the ids of this one
+        """
+        return array(ID_TYPECODE, (self.get_id(token) for token in tokens))
+
+    def decode(self, token_ids: Iterable[int]) -> str:
+        """
+        Join the tokens of the ids to a single line, the way cc2vec expects a line of code
+        :param token_ids: The ids of the tokens in the line
+        :return: The space separated tokens
+        """
+        return " ".join([self.tokens[token_id] for token_id in token_ids])
+
+
+VOCABULARY = Vocabulary()
+
+
+class TokenLines:
+    """
+    Lines of code stored as a single array of token ids and the end position of each line in that array
+    """
+    __slots__ = ("token_ids", "line_ends")
+
+    def __init__(self, lines: list[str], vocabulary: Vocabulary = VOCABULARY):
+        self.token_ids = array(ID_TYPECODE)
+        self.line_ends = array(ID_TYPECODE)
+        for line in lines:
+            self.token_ids.extend(vocabulary.get_id(token) for token in line.split())
+            self.line_ends.append(len(self.token_ids))
+
+    def __len__(self) -> int:
+        return len(self.line_ends)
+
+    def get_line_ids(self, idx: int) -> array:
+        start = self.line_ends[idx - 1] if idx > 0 else 0
+        return self.token_ids[start:self.line_ends[idx]]
+
+    def remap(self, id_map: array) -> None:
+        self.token_ids = array(ID_TYPECODE, (id_map[token_id] for token_id in self.token_ids))
+
+    def to_lines(self, vocabulary: Vocabulary = VOCABULARY) -> list[str]:
+        return [vocabulary.decode(self.get_line_ids(idx)) for idx in range(len(self))]
+
+
+class FileTokens:
+    """
+    The added and removed code of a changed file
+    """
+    __slots__ = ("added_code", "removed_code")
+
+    def __init__(self, added_code: list[str], removed_code: list[str], vocabulary: Vocabulary = VOCABULARY):
+        self.added_code = TokenLines(added_code, vocabulary)
+        self.removed_code = TokenLines(removed_code, vocabulary)
+
+    def remap(self, id_map: array) -> None:
+        """
+        Move the tokens to another vocabulary, e.g. when the file was created in a different process
+        :param id_map: Array mapping the current token ids to the ids in the other vocabulary
+        :return: None
+        """
+        self.added_code.remap(id_map)
+        self.removed_code.remap(id_map)
+
+    def to_cc2vec(self, vocabulary: Vocabulary = VOCABULARY) -> dict[str, list[str]]:
+        return {"added_code": self.added_code.to_lines(vocabulary),
+                "removed_code": self.removed_code.to_lines(vocabulary)}
+
+
+def iter_cc2vec_codes(codes: Iterable[list[FileTokens]], vocabulary: Vocabulary = VOCABULARY) -> \
+        Iterator[list[dict[str, list[str]]]]:
+    """
+    Lazily convert the compact codes to the nested list format cc2vec is trained on, so only the code of one commit is
+    converted at a time
+    :param codes: The codes of the commits
+    :param vocabulary: The vocabulary the codes were created with
+    :return: Iterator of the codes of the commits as lists of {"added_code": [...], "removed_code": [...]} dicts
+    """
+    for code in codes:
+        yield [file.to_cc2vec(vocabulary) for file in code]
+
+
+def to_cc2vec_codes(codes: Iterable[list[FileTokens]], vocabulary: Vocabulary = VOCABULARY) -> \
+        list[list[dict[str, list[str]]]]:
+    """
+    Convert the compact codes to the nested list format cc2vec is trained on. Holds every converted code in memory,
+    use iter_cc2vec_codes with save_streamed_pickle to write them to disk.
+    :param codes: The codes of the commits
+    :param vocabulary: The vocabulary the codes were created with
+    :return: The codes of the commits as lists of {"added_code": [...], "removed_code": [...]} dicts
+    """
+    return list(iter_cc2vec_codes(codes, vocabulary))